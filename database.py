@@ -1,23 +1,52 @@
+import utime
 import micropg
+from micropg import DataError
 import logging
+from utils import metrics
 from utils.connect import connect_to_network
+from utils.clock import TIMEZONE
 from env import PG_HOST, PG_USER, PG_PASSWORD, PG_DATABASE
 
 # Logging
 logger = logging.getLogger('pico-sump')
 
+# Metrics
+write_duration = metrics.Histogram('pico_db_write_seconds', 'Time taken to insert a batch of readings.')
+write_failures = metrics.Counter('pico_db_write_failures_total', 'Failed attempts to log readings to the database.')
+pending_readings = metrics.Gauge('pico_db_pending_readings', 'Readings queued for the database.')
+
 # Connect to the network
 connect_to_network()
 
 # Database ------------------------------------------------------------------ #
 class DatabaseAPI:
+    
+    # Store-and-forward queue of readings not yet written to the database
+    max_pending = 120   # Oldest readings are dropped beyond this
+    batch_size = 30     # Readings per INSERT statement
+    
+    # Connecting blocks the event loop, so a failed LISTEN connection is
+    # only tried again after listen_retry seconds, doubled after each
+    # failure up to listen_retry_max
+    listen_retry = 60
+    listen_retry_max = 3600
+    
     def __init__(self, host, user, password, database):
         self.host = host
         self.user = user
         self.password = password
         self.database = database
         
-    def connect(self):        
+        # Dedicated connection for LISTEN, notifications are only delivered
+        # to a session that is not inside a transaction block
+        self.listener = None
+        self.channel = None
+        self.retry_delay = 0
+        self.retry_at = None    # utime.ticks_ms() of the next attempt
+        
+        self.pending = []
+        
+    def connect(self, check_tables=True):        
         conn = micropg.connect(
             host=self.host,
             user=self.user,
@@ -27,7 +56,8 @@ class DatabaseAPI:
         )
         conn.autocommit = True
         
-        self.check_tables(conn)
+        if check_tables:
+            self.check_tables(conn)
         
         logger.info(f"Success: connected to database {self.database}")
         
@@ -64,15 +94,67 @@ class DatabaseAPI:
                 )
                 """
             )
+            cursor.execute(
+                """
+                CREATE OR REPLACE FUNCTION notify_sump_settings() RETURNS trigger AS $$
+                BEGIN
+                    PERFORM pg_notify('sump_settings_' || NEW.sump_id, row_to_json(NEW)::text);
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql
+                """
+            )
+            cursor.execute(
+                "DROP TRIGGER IF EXISTS sump_settings_notify ON sump_settings"
+            )
+            cursor.execute(
+                """
+                CREATE TRIGGER sump_settings_notify
+                AFTER INSERT OR UPDATE ON sump_settings
+                FOR EACH ROW EXECUTE PROCEDURE notify_sump_settings()
+                """
+            )
             cursor.execute(
                 """
                 CREATE TABLE IF NOT EXISTS sump_readings (
                     sump_id VARCHAR(255) NOT NULL,
-                    timestamp TIMESTAMP NOT NULL,
+                    seq BIGINT,
+                    timestamp TIMESTAMPTZ NOT NULL,
                     distance FLOAT NOT NULL
                 )
                 """
             )
+            # Migrate tables created before readings carried a sequence
+            # number and were stored as timestamptz. Older rows hold the
+            # device's local wall-clock time, so they are converted from its
+            # time zone rather than the server's
+            cursor.execute(
+                "ALTER TABLE sump_readings ADD COLUMN IF NOT EXISTS seq BIGINT"
+            )
+            cursor.execute(
+                f"""
+                DO $$
+                BEGIN
+                    IF EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'sump_readings'
+                        AND column_name = 'timestamp'
+                        AND data_type = 'timestamp without time zone'
+                    ) THEN
+                        ALTER TABLE sump_readings ALTER COLUMN timestamp TYPE TIMESTAMPTZ
+                        USING timestamp AT TIME ZONE '{TIMEZONE}';
+                    END IF;
+                END
+                $$
+                """
+            )
+            # Replayed readings are deduplicated on (sump_id, seq)
+            cursor.execute(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS sump_readings_sump_id_seq
+                ON sump_readings (sump_id, seq)
+                """
+            )
             
             logger.info(f"Database tables OK")
             
@@ -106,23 +188,166 @@ class DatabaseAPI:
                         
         return
     
-    async def log_data(self, sump_id, timestamp, distance):
+    def listen(self, channel):
+        # Replace any previous subscription, one channel per device
+        if self.retry_at is not None and utime.ticks_diff(self.retry_at, utime.ticks_ms()) > 0:
+            return
+        
         try:
-            conn = self.check_connection()
-            cursor = conn.cursor()
+            if self.listener is None or not self.listener.is_connect():
+                self.listener = self.connect(check_tables=False)
+            
+            self.listener.unlisten()
+            self.listener.listen(channel)
+            self.channel = channel
+            self.retry_delay = 0
+            self.retry_at = None
+            
+            logger.info(f"Listening for notifications on {channel}")
+            
+        except Exception as e:
+            
+            self.retry_later()
+            
+            logger.error(f"Failed to listen on {channel} in database {self.database}, retrying in {self.retry_delay} s. {e}")
+            
+            self.listener = None
+            self.channel = None
+            
+        return
+    
+    def retry_later(self):
+        # Back off before the next listen() attempt
+        self.retry_delay = min(2 * self.retry_delay or self.listen_retry, self.listen_retry_max)
+        self.retry_at = utime.ticks_add(utime.ticks_ms(), self.retry_delay * 1000)
+    
+    def poll_notifications(self):
+        # Non-blocking, returns a list of (pid, channel, payload) tuples
+        if self.listener is None:
+            return []
+        
+        try:
+            return self.listener.poll()
+        
+        except Exception as e:
+            
+            # The sensor listens again once the retry is due
+            self.listener = None
+            self.channel = None
+            self.retry_later()
+            
+            logger.warning(f"Notification connection to database {self.database} lost. Reconnecting in {self.retry_delay} s...")
+            
+        return []
+    
+    def last_seq(self, sump_id):
+        # Highest sequence number logged for the device, 0 if none, None if
+        # the database can't be reached
+        try:
+            cursor = self.check_connection().cursor()
             cursor.execute(
-                "INSERT INTO sump_readings(sump_id, timestamp, distance) "
-                "VALUES (%s, %s, %s)",
-                (sump_id, timestamp, distance)
+                "SELECT COALESCE(max(seq), 0) FROM sump_readings WHERE sump_id = %s",
+                [sump_id]
             )
+            return int(cursor.fetchone()[0])
+        
+        except Exception as e:
             
-            logger.info(f"Logged data to database {self.database}")
+            logger.error(f"Failed to read the last sequence number from database {self.database}. {e}")
+            
+        return None
+    
+    def export_readings(self, sump_id, from_timestamp=None, to_timestamp=None):
+        # COPY runs on its own connection so the stream can't interleave
+        # with log_data on the shared one, the connection is closed once
+        # the returned generator is exhausted or dropped. Raises ValueError
+        # for an invalid timestamp, errors while streaming are re-raised so
+        # the response is cut short rather than ended cleanly.
+        query = "COPY (SELECT timestamp, distance FROM sump_readings WHERE sump_id = %s"
+        args = [sump_id]
+        
+        if from_timestamp:
+            query += " AND timestamp >= %s"
+            args.append(from_timestamp)
+        if to_timestamp:
+            query += " AND timestamp < %s"
+            args.append(to_timestamp)
+            
+        query += " ORDER BY timestamp) TO STDOUT WITH CSV HEADER"
+        
+        conn = self.connect(check_tables=False)
+        chunks = conn.cursor().copy_out(query, tuple(args))
+        
+        # Start the COPY before the response is sent, so errors in the query
+        # are reported with a status code. The first chunk is the CSV header
+        try:
+            first = next(chunks)
+        except StopIteration:
+            first = None
+        except DataError as e:
+            conn.close()
+            raise ValueError(f"Invalid export range. {e}")
+        except Exception:
+            conn.close()
+            raise
+        
+        def export_generator():
+            try:
+                if first is not None:
+                    yield first
+                yield from chunks
+            except Exception as e:
+                logger.error(f"Failed to export data from database {self.database}. {e}")
+                raise
+            finally:
+                chunks.close()
+                conn.close()
+                
+        return export_generator()
+    
+    async def log_data(self, sump_id, seq, timestamp, distance):
+        # timestamp is in Unix epoch seconds, converted by the server
+        self.pending.append((sump_id, seq, timestamp, distance))
+        
+        if len(self.pending) > self.max_pending:
+            dropped = len(self.pending) - self.max_pending
+            del self.pending[:dropped]
+            logger.warning(f"Dropped {dropped} readings not yet logged to database {self.database}")
+        
+        self.flush()
+    
+    def flush(self):
+        # Inserts are idempotent, so a batch that failed part way through
+        # can simply be sent again
+        try:
+            conn = self.check_connection()
+            cursor = conn.cursor()
+            
+            while self.pending:
+                start = utime.ticks_us()
+                batch = self.pending[:self.batch_size]
+                args = []
+                for reading in batch:
+                    args.extend(reading)
+                    
+                cursor.execute(
+                    "INSERT INTO sump_readings(sump_id, seq, timestamp, distance) VALUES "
+                    + ", ".join(["(%s, %s, to_timestamp(%s), %s)"] * len(batch))
+                    + " ON CONFLICT (sump_id, seq) DO NOTHING",
+                    args
+                )
+                del self.pending[:len(batch)]
+                write_duration.observe(utime.ticks_diff(utime.ticks_us(), start))
+                
+                logger.info(f"Logged {len(batch)} readings to database {self.database}")
             
         except Exception as e:
             
-            logger.error(f"Failed to log data to database {self.database}. {e}")
+            write_failures.inc()
+            logger.error(f"Failed to log data to database {self.database}, {len(self.pending)} readings pending. {e}")
             
         return
 
 # Instantiate the database class once for global use ------------------------- #
-Database = DatabaseAPI(PG_HOST, PG_USER, PG_PASSWORD, PG_DATABASE)
\ No newline at end of file
+Database = DatabaseAPI(PG_HOST, PG_USER, PG_PASSWORD, PG_DATABASE)
+metrics.register_collector(lambda: pending_readings.set(len(Database.pending)))
\ No newline at end of file
@@ -0,0 +1,130 @@
+from array import array
+from struct import pack_into, unpack_from
+
+
+class ReadingHistory:
+    # Fixed size ring buffer of readings kept in flat buffers, so the history
+    # is allocated once at boot instead of as a list of tuples per reading.
+    # Sequence numbers only ever increase, which keeps the buffer sorted by
+    # seq and lets a client's cursor be found with a binary search.
+    #
+    # Timestamps (Unix epoch seconds) and distances are stored as packed
+    # little-endian int32 and float32 columns, so the binary /data format
+    # can be written straight from them.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.seqs = array('l', [0] * capacity)
+        self.timestamps = bytearray(4 * capacity)
+        self.distances = bytearray(4 * capacity)
+        self.start = 0  # Physical index of the oldest reading
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _index(self, i):
+        # Physical index of the i-th oldest reading
+        return (self.start + i) % self.capacity
+
+    def _reading(self, i):
+        return (
+            self.seqs[i],
+            unpack_from('<i', self.timestamps, 4 * i)[0],
+            unpack_from('<f', self.distances, 4 * i)[0],
+        )
+
+    def append(self, seq, timestamp, distance):
+        if self.count < self.capacity:
+            i = self._index(self.count)
+            self.count += 1
+        else:
+            # Full -- overwrite the oldest reading
+            i = self.start
+            self.start = (self.start + 1) % self.capacity
+
+        self.seqs[i] = seq
+        pack_into('<i', self.timestamps, 4 * i, timestamp)
+        pack_into('<f', self.distances, 4 * i, distance)
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+
+    def last(self):
+        # Latest (seq, timestamp, distance), or None if empty
+        if not self.count:
+            return None
+
+        return self._reading(self._index(self.count - 1))
+
+    @property
+    def cursor(self):
+        # Sequence number of the latest reading, 0 if empty
+        return self.seqs[self._index(self.count - 1)] if self.count else 0
+
+    def position_after(self, seq):
+        # Logical index of the first reading with a sequence number > seq
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.seqs[self._index(mid)] <= seq:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def position_since(self, timestamp):
+        # Logical index of the first reading taken after timestamp. The clock
+        # can be stepped by NTP, so timestamps are scanned rather than bisected
+        for n in range(self.count):
+            if unpack_from('<i', self.timestamps, 4 * self._index(n))[0] > timestamp:
+                return n
+
+        return self.count
+
+    def copy(self, first = 0):
+        # Snapshot of the readings from the first-th oldest on, for readers
+        # such as streamed responses that may still be running when new
+        # readings overwrite the oldest ones
+        count = max(self.count - first, 0)
+        snapshot = ReadingHistory(count)
+        timestamps = memoryview(self.timestamps)
+        distances = memoryview(self.distances)
+        
+        for n in range(count):
+            i = self._index(first + n)
+            snapshot.seqs[n] = self.seqs[i]
+            snapshot.timestamps[4 * n:4 * n + 4] = timestamps[4 * i:4 * i + 4]
+            snapshot.distances[4 * n:4 * n + 4] = distances[4 * i:4 * i + 4]
+        
+        snapshot.count = count
+        return snapshot
+    
+    def readings(self, after = None):
+        # Yield (seq, timestamp, distance) oldest first, only those newer
+        # than the cursor if one is given
+        start = self.position_after(after) if after is not None else 0
+
+        for n in range(start, self.count):
+            yield self._reading(self._index(n))
+
+    def columns(self, first = 0):
+        # Memoryviews of the timestamp column then the distance column, from
+        # the first-th oldest reading on. A wrapped buffer takes two slices
+        # per column
+        if first >= self.count:
+            return []
+
+        lo = self._index(first)
+        hi = self._index(self.count - 1) + 1
+        segments = [(lo, hi)] if lo < hi else [(lo, self.capacity), (0, hi)]
+
+        views = []
+        for column in (self.timestamps, self.distances):
+            view = memoryview(column)
+            for lo, hi in segments:
+                views.append(view[4 * lo:4 * hi])
+
+        return views
@@ -188,3 +188,92 @@ class MemoryHandler(BufferingHandler):
         finally:
             self.target = None
             BufferingHandler.close(self)
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    A handler class which keeps the most recent formatted records in a fixed
+    size ring buffer, numbered with increasing sequence numbers so that
+    readers can page through them and pick up where they left off.
+    """
+    def __init__(self, capacity):
+        """
+        Initialize the handler with the number of records to keep.
+        """
+        logging.Handler.__init__(self)
+        self.capacity = capacity
+        self.seqs = [0] * capacity
+        self.levels = [0] * capacity
+        self.messages = [None] * capacity
+        self.start = 0
+        self.count = 0
+        self.seq = 0
+
+    def emit(self, record):
+        """
+        Format the record and store it, overwriting the oldest record if the
+        buffer is full.
+        """
+        if record.levelno < self.level:
+            return
+
+        if self.count < self.capacity:
+            i = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            i = self.start
+            self.start = (self.start + 1) % self.capacity
+
+        self.seq += 1
+        self.seqs[i] = self.seq
+        self.levels[i] = record.levelno
+        self.messages[i] = self.format(record)
+
+    def position_after(self, seq):
+        """
+        Return the position of the first record with a sequence number above
+        seq, counting from the oldest record.
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.seqs[(self.start + mid) % self.capacity] <= seq:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def records(self, after=None, level=logging.NOTSET, limit=None):
+        """
+        Generate (seq, levelno, message) for the records newer than the
+        sequence number after, at level or above, oldest first and at most
+        limit of them.
+        """
+        n = self.position_after(after) if after is not None else 0
+        end = self.count
+        while n < end and limit != 0:
+            i = (self.start + n) % self.capacity
+            if self.levels[i] >= level:
+                yield self.seqs[i], self.levels[i], self.messages[i]
+                if limit is not None:
+                    limit -= 1
+            n += 1
+
+    def flush(self, zap=False):
+        """
+        Clear the buffer if zap is True, records are otherwise kept until
+        they are overwritten.
+        """
+        if zap:
+            self.start = 0
+            self.count = 0
+            self.messages = [None] * self.capacity
+
+    def close(self):
+        """
+        Close the handler and lose the buffer.
+        """
+        try:
+            self.flush(zap=True)
+        finally:
+            logging.Handler.close(self)
@@ -1,11 +1,27 @@
 import asyncio
+import ujson
 import logging
 import utils.connect as connection
-from logging.handlers import MemoryHandler
-from utils.clock import sync_time
+from logging.handlers import RingBufferHandler
+import utils.clock as clock
+from utils.clock import sync_time, datetime_to_string
+from utils.static import send_static
+from utils.cache import cached_response
+from utils import metrics
+from utils.timing import RequestTimer
+try:
+    from microdot.microdot_utemplate import init_templates, render_template
+    from utemplate import compiled
+except ImportError:
+    # Without utemplate the precompiled page is imported directly
+    render_template = None
+    from templates import index_html
 from sensor import PicoSumpSensor
-from microdot import Response
+from database import Database
+from microdot import Request, Response, urldecode_str
 from microdot.microdot_asyncio import Microdot
+from microdot.microdot_sse import Broadcaster, EventSource
+from microdot.microdot_asyncio_websocket import with_websocket, WebSocketError
 
 # Logging ------------------------------------------------------------------- #
 # Create logger
@@ -16,49 +32,86 @@ logger.setLevel(logging.DEBUG)
 stream_handler = logging.StreamHandler()
 stream_handler.setLevel(logging.DEBUG)
 
-# Create memory handler and set capacity to 50 entries
-memory_handler = MemoryHandler(capacity=50, flushLevel=logging.ERROR, target=stream_handler, flushOnClose=True)
+# Create ring buffer handler keeping the last 100 formatted records for /log
+log_buffer = RingBufferHandler(capacity=100)
 
 # Create a formatter
 formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
 
 # Add formatter to the handlers
 stream_handler.setFormatter(formatter)
-memory_handler.setFormatter(formatter)
+log_buffer.setFormatter(formatter)
 
 # Add handlers to logger
 logger.addHandler(stream_handler)
-logger.addHandler(memory_handler)
+logger.addHandler(log_buffer)
 
 # Server -------------------------------------------------------------------- #
 server = Microdot()
 Response.default_content_type = 'text/html'
 
+# Only small form posts are expected, keep the memory reserved per request low
+Request.max_content_length = 1024
+Request.max_body_length = 1024
+server.max_inflight_requests = 4
 
-with open('./static/index.html', 'r') as f:
-    html_string = f.read()
-    
-# with open('style.css', 'r') as f:
-#     css_string = f.read()
+# Live readings pushed to dashboards. Open streams give back their request
+# slot, so these limits bound them instead of max_inflight_requests
+events = EventSource(max_queue=8, max_clients=4)
+live = Broadcaster(max_queue=8, max_clients=4)
+
+# Time every request, per route and status code
+timer = RequestTimer(server)
+
+# Templates are compiled on the host (templates/index_html.py is generated
+# from templates/index.html by utemplate) and only imported on the device
+if render_template:
+    init_templates('templates', loader_class=compiled.Loader)
 
-with open('static/script.js', 'r') as f:
-    js_string = f.read()
 
 # Webserver routes
 @server.route('/')
 async def index(request):
-    await SumpSensor.read_sensors(loop=False)
-    # serve the index.html file with javascript
-    return html_string
+    # Readings come from the history, ?fresh=1 takes a new one first
+    if request.args.get('fresh'):
+        await SumpSensor.fresh_reading()
+    
+    # The page carries the current state, so it is rendered once per
+    # generation and served from the cache until then
+    def render():
+        if render_template is None:
+            page = index_html.render(initial_state())
+        else:
+            page = render_template('index.html', initial_state())
+        return page, {'Content-Type': 'text/html; charset=UTF-8'}
+    
+    return cached_response(request, SumpSensor.generation, render)
+
+
+def initial_state():
+    # Settings and readings for the dashboard's first paint, as columns like
+    # the binary /data format. Every < is escaped so the sump ID can't close
+    # the <script> element
+    epochs = []
+    distances = []
+    for seq, epoch, distance in SumpSensor.get_current_readings():
+        epochs.append(epoch)
+        distances.append(round(distance, 2))
+    
+    state = ujson.dumps({
+        'settings': SumpSensor.get_settings(),
+        'cursor': SumpSensor.history.cursor,
+        'utc_offset': clock.UTC_OFFSET,
+        'epochs': epochs,
+        'distances': distances,
+    })
+    return state.replace('<', '\\u003c')
 
 
 # Static CSS/JSS
 @server.route("/static/<path:path>")
 def static(request, path):
-    if ".." in path:
-        # directory traversal is not allowed
-        return "Not found", 404
-    return js_string
+    return send_static(request, path)
 
 @server.route('/reset', methods=['POST'])
 async def reset(request):
@@ -70,74 +123,248 @@ async def reset(request):
     return 'Sensor cache reset', 200
 
 
+log_levels = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'WARNING': logging.WARNING,
+    'ERROR': logging.ERROR,
+    'CRITICAL': logging.CRITICAL,
+}
+level_names = {levelno: name for name, levelno in log_levels.items()}
+
+
 @server.route('/log', methods=['GET'])
 async def log(request):
+    # Page through the buffered records: ?level=WARNING&after=<seq>&limit=<n>&format=json
+    try:
+        level = log_levels[request.args.get('level', 'DEBUG').upper()]
+        after = int(request.args['after']) if request.args.get('after') else None
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except (KeyError, ValueError):
+        return 'Invalid request, level must be one of {}'.format(', '.join(log_levels)), 400
     
-    # output = ''
-    # for record in memory_handler.buffer:
-    #     output += formatter.format(record) + '\n'
+    if limit is not None and limit < 1:
+        return 'Invalid request, limit must be at least 1', 400
     
-    # return output, 200
+    records = list(log_buffer.records(after=after, level=level, limit=limit))
+    
+    # Resume after the last record sent if the page is full, else after
+    # everything scanned so filtered out records are not scanned again
+    if limit and len(records) == limit:
+        cursor = records[-1][0]
+    else:
+        cursor = max(log_buffer.seq, after or 0)
+    
+    if request.args.get('format') == 'json':
+        return {
+            'cursor': cursor,
+            'records': (
+                {'seq': seq, 'level': level_names.get(levelno, str(levelno)), 'message': message}
+                for seq, levelno, message in records
+            ),
+        }
     
     def log_generator():
-        for log_msg in memory_handler.buffer:
-            yield log_msg + '\n <br>'
+        for seq, levelno, message in records:
+            yield message + '\n <br>'
         
-    return log_generator()
+    return log_generator(), 200, {'X-Log-Cursor': str(cursor)}
+
+
+def validate_settings(values):
+    validated = SumpSensor.get_settings()
+    types = SumpSensor.types
+    
+    update_msg = 'Updated setings: '
+    # Check for valid request, update validated dict
+    for f in types.keys():        
+        # Attempt to convert to correct type
+        try:
+            if values.get(f) is None:
+                raise ValueError
+            validated[f] = types[f](values.get(f))
+            update_msg += f'{f}={validated[f]}, '
+            
+        except:
+            msg = f'Invalid request, field {f} is not in request {list(values.keys())} or not the right type {types[f]}. Settings not updated.'
+            logger.error(msg)
+            return None, msg
+
+    logger.warning(update_msg)
+    
+    return validated, update_msg
 
 
 @server.route('/settings', methods=['POST', 'GET'])
 async def setdepth(request):
     
     if request.method == 'GET':
-        return SumpSensor.get_settings(), 200
+        return cached_response(
+            request, SumpSensor.settings_generation, SumpSensor.get_settings, group='settings'
+        )
     
     elif request.method == 'POST':
-        validated = SumpSensor.get_settings()
-        types = SumpSensor.types
-        
-        update_msg = 'Updated setings: '
-        # Check for valid request, update validated dict
-        for f in types.keys():        
-            # Attempt to convert to correct type
-            try:
-                if request.form.get(f) is None:
-                    raise ValueError
-                validated[f] = types[f](request.form.get(f))
-                update_msg += f'{f}={validated[f]}, '
-                
-            except:
-                msg = f'Invalid request, field {f} is not in request {request.keys()} or not the right type {types[f]}. Settings not updated.'
-                logger.error(msg)
-                return msg, 400
-
-        logger.warning(update_msg)
+        validated, msg = validate_settings(request.form)
+        if validated is None:
+            return msg, 400
             
         # Update the sensor settings
-        await SumpSensor.update_settings(**request.form)
+        await SumpSensor.update_settings(**validated)
         
         msg = f"Succesfully updated settings."
         return msg, 200
     else:
         return 'Invalid request method', 400
 
-@server.route('/data', methods = ['GET'])
-async def api_all(request):    
-
+def data_response(request, from_timestamp = None):
+    # Only send readings newer than the client's cursor, if it has one
+    after = request.args.get('after')
+    binary = request.args.get('format') == 'bin' or \
+        'application/octet-stream' in request.headers.get('Accept', '')
+    
+    def render():
+        # The cursor to send back as ?after= for the next delta
+        headers = {'X-Data-Cursor': str(SumpSensor.history.cursor), 'Vary': 'Accept'}
+        
+        if binary:
+            # int32 epoch seconds column, then float32 distances column
+            headers['Content-Type'] = 'application/octet-stream'
+            headers['X-UTC-Offset'] = str(clock.UTC_OFFSET)
+            return iter(SumpSensor.get_current_columns(from_timestamp, after=after)), headers
+        
+        return SumpSensor.get_current_data(from_timestamp, after=after), headers
+    
     logger.info('Client requested data')
     
-    return SumpSensor.get_current_data()
+    try:
+        after = int(after) if after else None
+        
+        if request.args.get('format') == 'json':
+            # Encoded while it is sent rather than cached whole
+            return {
+                'cursor': SumpSensor.history.cursor,
+                'utc_offset': clock.UTC_OFFSET,
+                'readings': SumpSensor.get_current_readings(from_timestamp, after=after),
+            }
+        
+        # Rendered once per new reading, whatever the number of clients
+        return cached_response(
+            request, SumpSensor.generation, render,
+            key=request.url + (' bin' if binary else '')
+        )
+    except ValueError as e:
+        return f'Invalid request. {e}', 400
+
+
+@server.route('/data', methods = ['GET'])
+async def api_all(request):    
+    return data_response(request)
 
 
 @server.route('/data/<from_timestamp>', methods = ['GET'])
 async def api(request, from_timestamp):
+    return data_response(request, urldecode_str(from_timestamp))
+
+
+@server.route('/events', methods = ['GET'])
+async def stream_events(request):
+    return events.response(request)
+
+
+@server.route('/ws', methods = ['GET'])
+@with_websocket
+async def websocket(request, ws):
+    client = live.subscribe()
+    if client is None:
+        await ws.close(1013)
+        return
     
-    from_timestamp = request.args.get('from_timestamp')
-    data = SumpSensor.get_current_data(from_timestamp)
+    # Push readings and settings changes while listening for updates
+    async def push():
+        try:
+            async for message in client:
+                await ws.send(message)
+            # Evicted for falling behind, the dashboard will reconnect
+            await ws.close(1013)
+        except WebSocketError:
+            pass
     
-    logger.info('Client requested data')
+    push_task = asyncio.create_task(push())
+    try:
+        while True:
+            try:
+                message = ujson.loads(await ws.receive())
+            except ValueError:
+                continue
+            
+            if not isinstance(message, dict) or message.get('type') != 'settings':
+                continue
+            
+            validated, msg = validate_settings(message.get('settings', {}))
+            if validated is None:
+                await ws.send(ujson.dumps({'type': 'error', 'message': msg}))
+                continue
+            
+            await SumpSensor.update_settings(**validated)
+    finally:
+        client.close()
+        push_task.cancel()
+
+
+def publish_settings(sensor):
+    # Settings changed over /ws, POST /settings or LISTEN, for every dashboard
+    live.broadcast(ujson.dumps({
+        'type': 'settings',
+        'settings': sensor.get_settings(),
+    }))
+
+
+def publish_reading(sensor):
+    if not events.clients and not live.clients:
+        return
+    
+    # Encode once for both the event stream and the websocket clients
+    data = ujson.dumps({
+        'seq': sensor.seq,
+        'timestamp': datetime_to_string(sensor.timestamp),
+        'distance': sensor.distance,
+    })
+    events.publish(data, event='reading')
+    live.broadcast('{"type": "reading", "reading": ' + data + '}')
+
+
+@server.route('/export.csv', methods = ['GET'])
+async def export(request):
+    
+    try:
+        rows = Database.export_readings(
+            SumpSensor.sump_id,
+            from_timestamp=request.args.get('from'),
+            to_timestamp=request.args.get('to')
+        )
+    except ValueError as e:
+        return str(e), 400
+    except Exception as e:
+        logger.error(f"Failed to start export. {e}")
+        return 'Database unavailable', 503
     
-    return data
+    logger.info('Client requested export')
+    
+    headers = {
+        'Content-Type': 'text/csv',
+        'Content-Disposition': 'attachment; filename="sump_readings.csv"',
+    }
+    return rows, 200, headers
+
+
+@server.route('/metrics')
+async def metrics_endpoint(request):
+    return metrics.exposition(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+@server.route('/debug/timing')
+async def timing(request):
+    return timer.summary()
 
 
 async def main():
@@ -149,6 +376,8 @@ async def main():
     # Instantiate the webserver class
     global SumpSensor
     SumpSensor = PicoSumpSensor(netinfo)
+    SumpSensor.reading_callbacks.append(publish_reading)
+    SumpSensor.settings_callbacks.append(publish_settings)
             
     # Sync the clock
     sync_time()
@@ -156,6 +385,7 @@ async def main():
     # Start the sensor reading task
     sensor_task = asyncio.create_task(SumpSensor.read_sensors())
     server_task = asyncio.create_task(server.start_server("0.0.0.0", port=80))
+    asyncio.create_task(metrics.monitor_loop_lag())
     
     logger.info('Setting up webserver...')
     
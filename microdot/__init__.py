@@ -99,6 +99,63 @@ def urlencode(s):
             '&', '%26').replace('=', '%3D')
 
 
+_json_scalars = (str, int, float, bool)
+
+
+def json_iter(obj):
+    """Encode an object as JSON, one piece at a time.
+
+    :param obj: The object to encode. Besides dictionaries, lists and
+                scalars, any iterable such as a tuple, an ``array`` or a
+                generator is encoded as a JSON array, consuming it as it is
+                encoded.
+
+    This is a generator that yields the JSON document as a sequence of
+    strings, so that large documents can be sent without being held in
+    memory as a whole.
+
+    Example::
+
+        >>> ''.join(json_iter({'a': (i * i for i in range(3))}))
+        '{"a": [0, 1, 4]}'
+    """
+    if obj is None or isinstance(obj, _json_scalars):
+        yield json.dumps(obj)
+    elif isinstance(obj, dict):
+        separator = '{'
+        for key, value in obj.items():
+            yield separator + json.dumps(
+                key if isinstance(key, str) else str(key)) + ': '
+            separator = ', '
+            yield from json_iter(value)
+        yield '}' if separator == ', ' else '{}'
+    else:
+        separator = '['
+        for item in obj:
+            if item is None or isinstance(item, _json_scalars):
+                # scalars go out with their separator in a single piece
+                yield separator + json.dumps(item)
+            else:
+                yield separator
+                yield from json_iter(item)
+            separator = ', '
+        yield ']' if separator == ', ' else '[]'
+
+
+def json_streams(obj):
+    """Return ``True`` if an object has iterables that ``json.dumps`` cannot
+    encode, such as generators or arrays, in it."""
+    if isinstance(obj, dict):
+        obj = obj.values()
+    elif not isinstance(obj, (list, tuple)):
+        return not (obj is None or isinstance(obj, _json_scalars))
+    for value in obj:
+        if value is not None and not isinstance(value, _json_scalars) and \
+                json_streams(value):
+            return True
+    return False
+
+
 class NoCaseDict(dict):
     """A subclass of dictionary that holds case-insensitive keys.
 
@@ -343,6 +400,9 @@ class Request():
         #: A general purpose container for applications to store data during
         #: the life of the request.
         self.g = Request.G()
+        #: The URL pattern of the route that matched the request, or ``None``
+        #: if no route matched.
+        self.url_rule = None
 
         self.http_version = http_version
         if '?' in self.path:
@@ -505,10 +565,12 @@ class Response():
     """An HTTP response class.
 
     :param body: The body of the response. If a dictionary or list is given,
-                 a JSON formatter is used to generate the body. If a file-like
-                 object or a generator is given, a streaming response is used.
-                 If a string is given, it is encoded from UTF-8. Else, the
-                 body should be a byte sequence.
+                 a JSON formatter is used to generate the body, streaming it
+                 with :func:`json_iter` if it contains generators, arrays or
+                 other iterables. If a file-like object or a generator is
+                 given, a streaming response is used. If a string is given, it
+                 is encoded from UTF-8. Else, the body should be a byte
+                 sequence.
     :param status_code: The numeric HTTP status code of the response. The
                         default is 200.
     :param headers: A dictionary of headers to include in the response.
@@ -540,6 +602,32 @@ class Response():
     #: written to the client. Used to exit WebSocket connections cleanly.
     already_handled = None
 
+    # pre-encoded pieces of the response head, to avoid formatting and
+    # encoding the lines that appear in most responses
+    _status_lines = {
+        ('1.0', 200): b'HTTP/1.0 200 OK\r\n',
+        ('1.1', 200): b'HTTP/1.1 200 OK\r\n',
+    }
+    _header_names = {
+        'Content-Type': b'Content-Type: ',
+        'Content-Length': b'Content-Length: ',
+        'Content-Encoding': b'Content-Encoding: ',
+        'Connection': b'Connection: ',
+        'Transfer-Encoding': b'Transfer-Encoding: ',
+        'Cache-Control': b'Cache-Control: ',
+        'ETag': b'ETag: ',
+        'Location': b'Location: ',
+        'Set-Cookie': b'Set-Cookie: ',
+    }
+    _header_values = {
+        'keep-alive': b'keep-alive',
+        'close': b'close',
+        'chunked': b'chunked',
+        'application/json; charset=UTF-8': b'application/json; charset=UTF-8',
+        'text/html; charset=UTF-8': b'text/html; charset=UTF-8',
+        'text/plain; charset=UTF-8': b'text/plain; charset=UTF-8',
+    }
+
     def __init__(self, body='', status_code=200, headers=None, reason=None):
         if body is None and status_code == 200:
             body = ''
@@ -548,7 +636,11 @@ class Response():
         self.headers = NoCaseDict(headers or {})
         self.reason = reason
         if isinstance(body, (dict, list)):
-            self.body = json.dumps(body).encode()
+            if json_streams(body):
+                # encoded as it is sent, without building the whole document
+                self.body = json_iter(body)
+            else:
+                self.body = json.dumps(body).encode()
             self.headers['Content-Type'] = 'application/json; charset=UTF-8'
         elif isinstance(body, str):
             self.body = body.encode()
@@ -602,22 +694,52 @@ class Response():
             if 'charset=' not in self.headers['Content-Type']:
                 self.headers['Content-Type'] += '; charset=UTF-8'
 
-    def write(self, stream):
-        self.complete()
+    def encode_head(self, http_version='1.0', *extra):
+        """Return the status line and headers of the response, assembled in
+        a single ``bytearray``.
 
-        # status code
-        reason = self.reason if self.reason is not None else \
-            ('OK' if self.status_code == 200 else 'N/A')
-        stream.write('HTTP/1.0 {status_code} {reason}\r\n'.format(
-            status_code=self.status_code, reason=reason).encode())
-
-        # headers
+        :param http_version: The HTTP version to use in the status line.
+        :param extra: Byte sequences to append after the headers, typically
+                      the first chunk of the body, so that the response can
+                      start with a single write.
+        """
+        if self.reason is None and \
+                (http_version, self.status_code) in self._status_lines:
+            parts = [self._status_lines[(http_version, self.status_code)]]
+        else:
+            reason = self.reason if self.reason is not None else \
+                ('OK' if self.status_code == 200 else 'N/A')
+            parts = ['HTTP/{http_version} {status_code} {reason}\r\n'.format(
+                http_version=http_version, status_code=self.status_code,
+                reason=reason).encode()]
         for header, value in self.headers.items():
+            name = self._header_names.get(header) or \
+                (header + ': ').encode()
             values = value if isinstance(value, list) else [value]
             for value in values:
-                stream.write('{header}: {value}\r\n'.format(
-                    header=header, value=value).encode())
-        stream.write(b'\r\n')
+                parts.append(name)
+                parts.append(self._header_values.get(value) or
+                             str(value).encode())
+                parts.append(b'\r\n')
+        parts.append(b'\r\n')
+        parts.extend(extra)
+
+        buf = bytearray(sum(len(part) for part in parts))
+        n = 0
+        for part in parts:
+            buf[n:n + len(part)] = part
+            n += len(part)
+        return buf
+
+    def write(self, stream):
+        self.complete()
+
+        # status code and headers, sent along with a small body
+        if not self.is_head and isinstance(self.body, bytes) and \
+                len(self.body) <= self.send_file_buffer_size:
+            stream.write(self.encode_head('1.0', self.body))
+            return
+        stream.write(self.encode_head('1.0'))
 
         # body
         if not self.is_head:
@@ -724,6 +846,7 @@ class URLPattern():
         self.url_pattern = url_pattern
         self.pattern = ''
         self.args = []
+        self.segments = []  # (type, name) for arguments, (None, text) else
         use_regex = False
         for segment in url_pattern.lstrip('/').split('/'):
             if segment and segment[0] == '<':
@@ -748,8 +871,10 @@ class URLPattern():
                 use_regex = True
                 self.pattern += '/({pattern})'.format(pattern=pattern)
                 self.args.append({'type': type_, 'name': name})
+                self.segments.append((type_, name))
             else:
                 self.pattern += '/{segment}'.format(segment=segment)
+                self.segments.append((None, segment))
         if use_regex:
             self.pattern = re.compile('^' + self.pattern + '$')
 
@@ -772,6 +897,116 @@ class URLPattern():
         return args
 
 
+class _RouteNode():
+    def __init__(self):
+        self.children = {}  # static segment -> node
+        self.args = []  # (type, node) for single segment arguments
+        self.path = None  # node after a path argument
+        self.routes = []  # routes ending at this node
+
+
+class Router():
+    """A compiled form of an application's URL map.
+
+    Static URLs are found with a dictionary lookup, and URLs with dynamic
+    components by walking a tree of path segments, so the cost of finding a
+    route does not grow with the number of routes. Routes that use regular
+    expression components are matched with their regular expression.
+
+    :param url_map: The list of ``(methods, url_pattern, handler)`` tuples
+                    of the application.
+
+    When more than one route matches a URL, the one registered first wins,
+    as if the URL map was searched in order.
+    """
+    converters = {'int': int}
+
+    def __init__(self, url_map):
+        self.size = len(url_map)
+        self.static = {}
+        self.root = _RouteNode()
+        self.regex = []
+        for index, (methods, pattern, handler) in enumerate(url_map):
+            names = [name for type_, name in pattern.segments
+                     if type_ is not None]
+            route = (index, set(methods), handler, pattern, names)
+            if not names:
+                self.static.setdefault(pattern.pattern, []).append(route)
+            elif [t for t, n in pattern.segments if t and t[:3] == 're:']:
+                self.regex.append(route)
+            else:
+                node = self.root
+                for type_, name in pattern.segments:
+                    node = self._child(node, type_, name)
+                node.routes.append(route)
+
+    @staticmethod
+    def _child(node, type_, name):
+        if type_ is None:
+            child = node.children.get(name)
+            if child is None:
+                child = node.children[name] = _RouteNode()
+            return child
+        if type_ == 'path':
+            if node.path is None:
+                node.path = _RouteNode()
+            return node.path
+        for arg_type, child in node.args:
+            if arg_type == type_:
+                return child
+        child = _RouteNode()
+        node.args.append((type_, child))
+        return child
+
+    def matches(self, path):
+        """Return the ``(route, url_args)`` pairs that match a path, in
+        registration order."""
+        found = []
+        for route in self.static.get(path, ()):
+            found.append((route, {}))
+        if path[:1] == '/':
+            self._walk(self.root, path[1:].split('/'), 0, [], found)
+        for route in self.regex:
+            args = route[3].match(path)
+            if args is not None:
+                found.append((route, args))
+        if len(found) > 1:
+            found.sort(key=lambda match: match[0][0])
+        return found
+
+    def _walk(self, node, segments, i, values, found):
+        if i == len(segments):
+            for route in node.routes:
+                args = {}
+                for name, (type_, value) in zip(route[4], values):
+                    converter = self.converters.get(type_)
+                    args[name] = converter(value) if converter else value
+                found.append((route, args))
+            return
+        segment = segments[i]
+        child = node.children.get(segment)
+        if child is not None:
+            self._walk(child, segments, i + 1, values, found)
+        for type_, child in node.args:
+            if segment and (type_ != 'int' or self._is_int(segment)):
+                values.append((type_, segment))
+                self._walk(child, segments, i + 1, values, found)
+                values.pop()
+        if node.path is not None:
+            # a path argument takes one or more segments, longest first
+            for j in range(len(segments), i, -1):
+                value = '/'.join(segments[i:j])
+                if value:
+                    values.append(('path', value))
+                    self._walk(node.path, segments, j, values, found)
+                    values.pop()
+
+    @staticmethod
+    def _is_int(segment):
+        digits = segment[1:] if segment[0] == '-' else segment
+        return digits.isdigit()
+
+
 class HTTPException(Exception):
     def __init__(self, status_code, reason=None):
         self.status_code = status_code
@@ -800,11 +1035,13 @@ class Microdot():
         self.before_request_handlers = []
         self.after_request_handlers = []
         self.after_error_request_handlers = []
+        self.after_response_handlers = []
         self.error_handlers = {}
         self.shutdown_requested = False
         self.options_handler = self.default_options_handler
         self.debug = False
         self.server = None
+        self.router = None
 
     def route(self, url_pattern, methods=None):
         """Decorator that is used to register a function as a request handler
@@ -981,6 +1218,22 @@ class Microdot():
         self.after_error_request_handlers.append(f)
         return f
 
+    def after_response(self, f):
+        """Decorator to register a function to run after a response has been
+        sent to the client. The decorated function must take two arguments,
+        the request and response objects. The return value of the function is
+        ignored. This is the place to log or measure complete requests,
+        including the time taken to send streamed bodies.
+
+        Example::
+
+            @app.after_response
+            def func(request, response):
+                # ...
+        """
+        self.after_response_handlers.append(f)
+        return f
+
     def errorhandler(self, status_code_or_exception_class):
         """Decorator to register a function as an error handler. Error handler
         functions for numeric HTTP status codes must accept a single argument,
@@ -1124,6 +1377,13 @@ class Microdot():
         """
         self.shutdown_requested = True
 
+    def get_router(self):
+        """Return the :class:`Router` for the URL map, compiling it again if
+        routes were added since it was last compiled."""
+        if self.router is None or self.router.size != len(self.url_map):
+            self.router = Router(self.url_map)
+        return self.router
+
     def find_route(self, req):
         method = req.method.upper()
         if method == 'OPTIONS' and self.options_handler:
@@ -1131,21 +1391,20 @@ class Microdot():
         if method == 'HEAD':
             method = 'GET'
         f = 404
-        for route_methods, route_pattern, route_handler in self.url_map:
-            req.url_args = route_pattern.match(req.path)
-            if req.url_args is not None:
-                if method in route_methods:
-                    f = route_handler
-                    break
-                else:
-                    f = 405
+        for route, url_args in self.get_router().matches(req.path):
+            req.url_args = url_args
+            if method in route[1]:
+                f = route[2]
+                req.url_rule = route[3].url_pattern
+                break
+            else:
+                f = 405
         return f
 
     def default_options_handler(self, req):
         allow = []
-        for route_methods, route_pattern, route_handler in self.url_map:
-            if route_pattern.match(req.path) is not None:
-                allow.extend(route_methods)
+        for route, url_args in self.get_router().matches(req.path):
+            allow.extend(self.url_map[route[0]][0])
         if 'GET' in allow:
             allow.append('HEAD')
         allow.append('OPTIONS')
@@ -1173,6 +1432,9 @@ class Microdot():
         try:
             if res and res != Response.already_handled:  # pragma: no branch
                 res.write(stream)
+                if req:
+                    for handler in self.after_response_handlers:
+                        handler(req, res)
             stream.close()
         except OSError as exc:  # pragma: no cover
             if exc.errno in MUTED_SOCKET_ERRORS:
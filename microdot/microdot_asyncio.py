@@ -16,9 +16,21 @@ try:
 except ImportError:
     import io
 
+import gc
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:  # pragma: no cover
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_diff(a, b):
+        return a - b
+
 from microdot import Microdot as BaseMicrodot
 from microdot import mro
-from microdot import NoCaseDict
 from microdot import Request as BaseRequest
 from microdot import Response as BaseResponse
 from microdot import print_exception
@@ -30,6 +42,12 @@ def _iscoroutine(coro):
     return hasattr(coro, 'send') and hasattr(coro, 'throw')
 
 
+def _wait_for(coro, timeout):
+    # wait_for() runs the coroutine in a new task, which is only worth it
+    # when there is a timeout
+    return coro if timeout is None else asyncio.wait_for(coro, timeout)
+
+
 class _AsyncBytesIO:
     def __init__(self, data):
         self.stream = io.BytesIO(data)
@@ -53,9 +71,192 @@ class _AsyncBytesIO:
         pass
 
 
+class _BufferedWriter:
+    # Collects the pieces of a response body in a reusable buffer so that
+    # many small pieces go out in a few socket writes, each one framed as a
+    # single chunk when chunked transfer encoding is used. The status line
+    # and headers are sent with the first write.
+
+    # room left in front of the data for the chunk size line, and after it
+    # for the chunk terminator
+    head_room = 10
+    tail_room = 2
+
+    def __init__(self, stream, response, chunked):
+        self.stream = stream
+        self.response = response
+        self.chunked = chunked
+        self.size = response.write_buffer_size
+        self.buf = None
+        self.n = 0
+        self.head_sent = False
+
+    async def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if not data:
+            return
+        if self.n + len(data) > self.size:
+            await self.flush()
+        if len(data) > self.size:
+            # too large to buffer, send it as its own write
+            await self.send(data)
+            return
+        if self.buf is None:
+            self.buf = Response._take_buffer(
+                self.head_room + self.size + self.tail_room)
+        start = self.head_room + self.n
+        self.buf[start:start + len(data)] = data
+        self.n += len(data)
+
+    async def send(self, data):
+        # send data right away, after anything already buffered
+        await self.flush()
+        if data:
+            await self._send(data, framed=False)
+
+    async def flush(self):
+        if not self.n:
+            return
+        n = self.n
+        self.n = 0
+        buf = memoryview(self.buf)
+        start = self.head_room
+        end = start + n
+        if self.chunked:
+            size_line = '{:x}\r\n'.format(n).encode()
+            start -= len(size_line)
+            self.buf[start:self.head_room] = size_line
+            self.buf[end:end + 2] = b'\r\n'
+            end += 2
+        await self._send(buf[start:end], framed=True)
+
+    async def close(self):
+        await self.flush()
+        if not self.head_sent:
+            self._first_byte()
+            await self._awrite(self.response.encode_head(
+                self.response.http_version,
+                *((b'0\r\n\r\n',) if self.chunked else ())))
+        elif self.chunked:
+            await self._awrite(b'0\r\n\r\n')
+        self.release()
+
+    def _first_byte(self):
+        self.head_sent = True
+        if self.response.first_byte_handler:
+            self.response.first_byte_handler()
+
+    def release(self):
+        if self.buf is not None:
+            Response._write_buffers.append(self.buf)
+            self.buf = None
+
+    async def _send(self, data, framed):
+        parts = (data,)
+        if self.chunked and not framed:
+            parts = ('{:x}\r\n'.format(len(data)).encode(), data, b'\r\n')
+        if not self.head_sent:
+            self._first_byte()
+            if len(data) <= self.size + self.head_room + self.tail_room:
+                await self._awrite(self.response.encode_head(
+                    self.response.http_version, *parts))
+                return
+            await self._awrite(self.response.encode_head(
+                self.response.http_version))
+        for part in parts:
+            await self._awrite(part)
+
+    async def _awrite(self, data):
+        # a client that stops reading makes the write wait until the socket
+        # has room again, which is given send_timeout seconds
+        await _wait_for(self.stream.awrite(data), self.response.send_timeout)
+
+
+class RequestHeaders:
+    """The headers of a request, parsed from the request head on demand.
+
+    :param head: The request head, as a bytes object.
+    :param start: The offset of the first header in ``head``.
+
+    Header names are case-insensitive. While parsing, only the position of
+    each value in the head is recorded, values are decoded the first time
+    they are accessed. When a header is repeated, the last value is used.
+    """
+    def __init__(self, head, start=0):
+        self.head = head
+        self.values = {}  # lowercase name -> (start, end) or decoded value
+        view = memoryview(head)
+        while True:
+            eol = head.find(b'\n', start)
+            end = eol - 1 if eol > 0 and head[eol - 1] == 13 else eol
+            if end <= start:
+                break  # the blank line that ends the head
+            colon = head.find(b':', start, end)
+            if colon < 0:
+                raise ValueError('invalid header')
+            value = colon + 1
+            while value < end and head[value] in (9, 32):
+                value += 1
+            while end > value and head[end - 1] in (9, 32):
+                end -= 1
+            self.values[str(view[start:colon], 'utf-8').lower()] = \
+                (value, end)
+            start = eol + 1
+
+    def __getitem__(self, key):
+        key = key.lower()
+        value = self.values[key]
+        if isinstance(value, tuple):
+            value = str(memoryview(self.head)[value[0]:value[1]], 'utf-8')
+            self.values[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.values[key.lower()] = value
+
+    def __delitem__(self, key):
+        del self.values[key.lower()]
+
+    def __contains__(self, key):
+        return key.lower() in self.values
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, key, default=None):
+        if key.lower() not in self.values:
+            return default
+        return self[key]
+
+    def keys(self):
+        return self.values.keys()
+
+    def items(self):
+        return [(key, self[key]) for key in self.values]
+
+
 class Request(BaseRequest):
+    #: Specify the maximum size of the request line and headers together.
+    #: Requests with larger heads are rejected with a 400 status code.
+    max_head_length = 2 * 1024
+
+    #: The number of seconds a client has to send the request line and
+    #: headers, once the server starts reading them. Connections that take
+    #: longer are closed. Set to ``None`` to wait indefinitely.
+    head_timeout = 5
+
+    #: The number of seconds a client has to send a request body that is
+    #: read into memory. Connections that take longer are closed. Set to
+    #: ``None`` to wait indefinitely.
+    body_timeout = 5
+
     @staticmethod
-    async def create(app, client_reader, client_writer, client_addr):
+    async def create(app, client_reader, client_writer, client_addr,
+                     head_timeout=None):
         """Create a request object.
 
         :param app: The Microdot application instance.
@@ -64,35 +265,30 @@ class Request(BaseRequest):
         :param client_writer: An output stream where the response data can be
                               written.
         :param client_addr: The address of the client, as a tuple.
+        :param head_timeout: The number of seconds allowed to read the request
+                             line and headers. The default is no limit.
 
         This method is a coroutine. It returns a newly created ``Request``
-        object.
+        object. If the request is not received in time,
+        ``asyncio.TimeoutError`` is raised.
         """
-        # request line
-        line = (await Request._safe_readline(client_reader)).strip().decode()
-        if not line:
+        # the request line and headers are read in one piece, and only the
+        # positions of the header values are recorded
+        head = await _wait_for(Request._read_head(client_reader),
+                               head_timeout)
+        if not head:
             return None
-        method, url, http_version = line.split()
+        eol = head.find(b'\n')
+        method, url, http_version = str(head[:eol], 'utf-8').split()
         http_version = http_version.split('/', 1)[1]
-
-        # headers
-        headers = NoCaseDict()
-        content_length = 0
-        while True:
-            line = (await Request._safe_readline(
-                client_reader)).strip().decode()
-            if line == '':
-                break
-            header, value = line.split(':', 1)
-            value = value.strip()
-            headers[header] = value
-            if header.lower() == 'content-length':
-                content_length = int(value)
+        headers = RequestHeaders(head, eol + 1)
+        content_length = int(headers.get('content-length', 0))
 
         # body
         body = b''
         if content_length and content_length <= Request.max_body_length:
-            body = await client_reader.readexactly(content_length)
+            body = await _wait_for(client_reader.readexactly(content_length),
+                                   Request.body_timeout)
             stream = None
         else:
             body = b''
@@ -108,6 +304,35 @@ class Request(BaseRequest):
             self._stream = _AsyncBytesIO(self._body)
         return self._stream
 
+    @staticmethod
+    async def _read_head(stream):
+        if hasattr(stream, 'readuntil'):
+            try:
+                head = await stream.readuntil(b'\r\n\r\n')
+            except EOFError as exc:
+                if not getattr(exc, 'partial', None):
+                    return b''
+                raise
+            if len(head) > Request.max_head_length:
+                raise ValueError('request head too long')
+            return head
+        # streams without readuntil (MicroPython) are read line by line, as
+        # reading ahead would consume the body, and joined once complete
+        lines = []
+        n = 0
+        while True:
+            line = await Request._safe_readline(stream)
+            if not line:
+                if not n:
+                    return b''
+                raise EOFError('incomplete request head')
+            n += len(line)
+            if n > Request.max_head_length:
+                raise ValueError('request head too long')
+            lines.append(line)
+            if line == b'\r\n' or line == b'\n':
+                return b''.join(lines)
+
     @staticmethod
     async def _safe_readline(stream):
         line = (await stream.readline())
@@ -120,10 +345,11 @@ class Response(BaseResponse):
     """An HTTP response class.
 
     :param body: The body of the response. If a dictionary or list is given,
-                 a JSON formatter is used to generate the body. If a file-like
-                 object or an async generator is given, a streaming response is
-                 used. If a string is given, it is encoded from UTF-8. Else,
-                 the body should be a byte sequence.
+                 a JSON formatter is used to generate the body, streaming it
+                 if it contains generators, arrays or other iterables. If a
+                 file-like object or an async generator is given, a streaming
+                 response is used. If a string is given, it is encoded from
+                 UTF-8. Else, the body should be a byte sequence.
     :param status_code: The numeric HTTP status code of the response. The
                         default is 200.
     :param headers: A dictionary of headers to include in the response.
@@ -131,37 +357,96 @@ class Response(BaseResponse):
                    default is "OK" for responses with a 200 status code and
                    "N/A" for any other status codes.
     """
+    #: The HTTP version used in the status line, set by the server to match
+    #: the request.
+    http_version = '1.0'
+
+    #: Whether the connection is kept open after this response. The server
+    #: sets this before writing the response, and it is cleared if the body
+    #: cannot be framed for the client's HTTP version.
+    keep_alive = False
+
+    #: The size of the buffer the pieces of a response body are collected in
+    #: before they are written to the socket. Buffers are reused by later
+    #: responses.
+    write_buffer_size = 1024
+
+    #: The number of seconds a client has to accept each write of a
+    #: response. A client that stops reading for longer is considered
+    #: stalled, its response is stopped, the body closed and the connection
+    #: closed. This also applies to async bodies. Set to ``None`` to wait
+    #: indefinitely.
+    send_timeout = 5
+
+    #: A function called with no arguments right before the first byte of
+    #: the response is written to the socket, or ``None``. Since the status
+    #: line and headers are sent along with the start of the body, this
+    #: marks when the client starts receiving a streamed response.
+    first_byte_handler = None
+
+    _write_buffers = []
+
+    @classmethod
+    def _take_buffer(cls, size):
+        while cls._write_buffers:
+            buf = cls._write_buffers.pop()
+            if len(buf) == size:
+                return buf
+        return bytearray(size)
 
     async def write(self, stream):
         self.complete()
 
+        # a persistent connection needs the end of the body to be known,
+        # either from Content-Length or from chunked transfer encoding
+        chunked = False
+        if self.keep_alive and not self.is_head and \
+                self.status_code not in (204, 304) and \
+                'Content-Length' not in self.headers:
+            if self.http_version == '1.1':
+                self.headers['Transfer-Encoding'] = 'chunked'
+                chunked = True
+            else:
+                self.keep_alive = False
+        self.headers['Connection'] = 'keep-alive' if self.keep_alive \
+            else 'close'
+
+        writer = _BufferedWriter(stream, self, chunked)
         try:
-            # status code
-            reason = self.reason if self.reason is not None else \
-                ('OK' if self.status_code == 200 else 'N/A')
-            await stream.awrite('HTTP/1.0 {status_code} {reason}\r\n'.format(
-                status_code=self.status_code, reason=reason).encode())
-
-            # headers
-            for header, value in self.headers.items():
-                values = value if isinstance(value, list) else [value]
-                for value in values:
-                    await stream.awrite('{header}: {value}\r\n'.format(
-                        header=header, value=value).encode())
-            await stream.awrite(b'\r\n')
-
-            # body
-            if not self.is_head:
+            if self.is_head:
+                pass
+            elif isinstance(self.body, bytes):
+                # a complete body needs no buffering
+                await writer.send(self.body)
+            else:
+                # an async body can wait for a long time between pieces, so
+                # each one is sent as soon as it arrives
+                flush = hasattr(self.body, '__anext__')
                 async for body in self.body_iter():
-                    if isinstance(body, str):  # pragma: no cover
-                        body = body.encode()
-                    await stream.awrite(body)
+                    await writer.write(body)
+                    if flush:
+                        await writer.flush()
+            await writer.close()
+        except asyncio.TimeoutError:
+            # the client stalled, its body is not read any further
+            self.keep_alive = False
         except OSError as exc:  # pragma: no cover
+            self.keep_alive = False
             if exc.errno in MUTED_SOCKET_ERRORS or \
                     exc.args[0] == 'Connection lost':
                 pass
             else:
                 raise
+        finally:
+            writer.release()
+            # let streaming bodies release their resources when the client
+            # goes away before the end of the stream
+            if hasattr(self.body, 'aclose'):
+                await self.body.aclose()
+            elif hasattr(self.body, 'close'):
+                result = self.body.close()
+                if _iscoroutine(result):  # pragma: no cover
+                    await result
 
     def body_iter(self):
         if hasattr(self.body, '__anext__'):
@@ -186,7 +471,10 @@ class Response(BaseResponse):
                         self.i = 2  # response body is a file-like object
                     elif hasattr(response.body, '__next__'):
                         self.i = 1  # response body is a sync generator
-                        return next(response.body)
+                        try:
+                            return next(response.body)
+                        except StopIteration:
+                            raise StopAsyncIteration
                     else:
                         self.i = -1  # response body is a plain string
                         return response.body
@@ -210,6 +498,52 @@ class Response(BaseResponse):
 
 
 class Microdot(BaseMicrodot):
+    #: The number of seconds an idle persistent connection is kept open
+    #: waiting for the next request.
+    keepalive_timeout = 5
+
+    #: The number of seconds between checks for persistent connections that
+    #: have been idle for longer than ``keepalive_timeout``.
+    reap_interval = 1
+
+    #: The maximum number of requests served on a single connection before
+    #: it is closed. Set to 1 to disable persistent connections.
+    max_keepalive_requests = 20
+
+    #: The maximum number of connections served at the same time. Further
+    #: connections wait for one to finish. Connections that turn into
+    #: long-lived streams give their slot back, see :func:`start_stream`.
+    max_inflight_requests = 4
+
+    #: The maximum number of connections waiting to be served. Connections
+    #: beyond this receive a 503 response right away.
+    max_waiting_requests = 8
+
+    #: The number of seconds a connection waits to be served before it
+    #: receives a 503 response.
+    admission_timeout = 2
+
+    #: The memory needed to serve a request, in addition to a body of up to
+    #: ``Request.max_body_length`` bytes and a request head. Requests are not
+    #: admitted while ``gc.mem_free()`` is below the total, on ports that
+    #: provide it.
+    request_memory_overhead = 4 * 1024
+
+    #: The response sent to connections that cannot be served.
+    busy_response = (b'HTTP/1.0 503 Service Unavailable\r\n'
+                     b'Content-Type: text/plain\r\n'
+                     b'Content-Length: 11\r\n'
+                     b'Retry-After: 1\r\n'
+                     b'Connection: close\r\n\r\n'
+                     b'Server busy')
+
+    def __init__(self):
+        super().__init__()
+        self.inflight = 0
+        self.waiting = []
+        self.idle = []
+        self.streams = []
+
     async def start_server(self, host='0.0.0.0', port=5000, debug=False,
                            ssl=None):
         """Start the Microdot web server as a coroutine. This coroutine does
@@ -255,6 +589,10 @@ class Microdot(BaseMicrodot):
             if not hasattr(writer, 'awrite'):  # pragma: no cover
                 # CPython provides the awrite and aclose methods in 3.8+
                 async def awrite(self, data):
+                    # response buffers are reused once this returns, and the
+                    # transport may hold on to what it could not send yet
+                    if not isinstance(data, bytes):
+                        data = bytes(data)
                     self.write(data)
                     await self.drain()
 
@@ -266,12 +604,23 @@ class Microdot(BaseMicrodot):
                 writer.awrite = MethodType(awrite, writer)
                 writer.aclose = MethodType(aclose, writer)
 
-            await self.handle_request(reader, writer)
+            if await self.admit():
+                try:
+                    await self.handle_request(reader, writer)
+                finally:
+                    if writer in self.streams:
+                        self.streams.remove(writer)
+                    else:
+                        self.release()
+            else:
+                await self.reject(reader, writer)
 
         if self.debug:  # pragma: no cover
             print('Starting async server on {host}:{port}...'.format(
                 host=host, port=port))
 
+        reaper = asyncio.create_task(self.reap_idle())
+
         try:
             self.server = await asyncio.start_server(serve, host, port,
                                                      ssl=ssl)
@@ -291,6 +640,7 @@ class Microdot(BaseMicrodot):
                 # the task hasn't been initialized in the server object yet
                 # wait a bit and try again
                 await asyncio.sleep(0.1)
+        reaper.cancel()
 
     def run(self, host='0.0.0.0', port=5000, debug=False, ssl=None):
         """Start the web server. This function does not normally return, as
@@ -329,17 +679,174 @@ class Microdot(BaseMicrodot):
     def shutdown(self):
         self.server.close()
 
-    async def handle_request(self, reader, writer):
-        req = None
+    def request_memory(self):
+        """Return the memory estimated to be needed to serve a request."""
+        return Request.max_body_length + Request.max_head_length + \
+            self.request_memory_overhead
+
+    def has_memory(self):
+        """Return ``True`` if there is enough free memory to serve another
+        request, collecting garbage first if needed."""
+        if not hasattr(gc, 'mem_free'):  # pragma: no cover
+            return True
+        needed = self.request_memory()
+        if gc.mem_free() < needed:
+            gc.collect()
+        return gc.mem_free() >= needed
+
+    async def admit(self):
+        """Wait until a new connection can be served.
+
+        This method is a coroutine. It returns ``True`` when the connection
+        has been given a slot, which must be given back with
+        :func:`release`, or ``False`` if the server is too busy.
+        """
+        if self.inflight < self.max_inflight_requests and self.has_memory():
+            self.inflight += 1
+            return True
+        if len(self.waiting) >= self.max_waiting_requests:
+            return False
+
+        # close a persistent connection waiting for its next request to make
+        # room for this one
+        if self.idle:
+            self.idle.pop(0)[1].cancel()
+
+        event = asyncio.Event()
+        self.waiting.append(event)
         try:
-            req = await Request.create(self, reader, writer,
-                                       writer.get_extra_info('peername'))
-        except Exception as exc:  # pragma: no cover
-            print_exception(exc)
-
-        res = await self.dispatch_request(req)
-        if res != Response.already_handled:  # pragma: no branch
-            await res.write(writer)
+            await asyncio.wait_for(event.wait(), self.admission_timeout)
+        except asyncio.TimeoutError:
+            pass
+        if event in self.waiting:
+            self.waiting.remove(event)
+            return False
+        return True  # the slot was handed over by release()
+
+    def release(self):
+        """Give back the slot of a connection that has been served."""
+        if self.waiting:
+            # hand the slot over to the connection that waited the longest
+            self.waiting.pop(0).set()
+        else:
+            self.inflight -= 1
+
+    def start_stream(self, req):
+        """Give back the slot of the connection of a request that turns into
+        a long-lived stream, such as a WebSocket or an async response body,
+        so that open streams cannot keep other requests out. The number of
+        streams must be limited by the code that serves them. The connection
+        is closed when the stream ends.
+
+        :param req: The request that is starting the stream.
+        """
+        writer = req.sock[1]
+        if writer not in self.streams:
+            self.streams.append(writer)
+            self.release()
+
+    async def reap_idle(self):
+        """Close the persistent connections that have been waiting for their
+        next request for longer than ``keepalive_timeout``.
+
+        This method is a coroutine. It is started by :func:`start_server` and
+        runs until the server stops.
+        """
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            # connections are added to the idle list as they become idle, so
+            # the ones that have waited the longest are first
+            now = ticks_ms()
+            while self.idle and ticks_diff(now, self.idle[0][0]) >= \
+                    self.keepalive_timeout * 1000:
+                self.idle.pop(0)[1].cancel()
+
+    async def reject(self, reader, writer):
+        try:
+            # read the request head first, so that closing the connection
+            # does not reset it before the client sees the response
+            try:
+                await asyncio.wait_for(self._skip_head(reader),
+                                       self.admission_timeout)
+            except asyncio.TimeoutError:
+                pass
+            await writer.awrite(self.busy_response)
+            await writer.aclose()
+        except OSError as exc:  # pragma: no cover
+            if exc.errno not in MUTED_SOCKET_ERRORS:
+                raise
+
+    @staticmethod
+    async def _skip_head(reader):
+        while True:
+            line = await reader.readline()
+            if len(line) > Request.max_readline or line.strip() == b'':
+                break
+
+    async def handle_request(self, reader, writer):
+        served = 0
+        while True:
+            req = None
+            failed = False
+            try:
+                if served:
+                    # an idle connection is closed by the reaper after
+                    # keepalive_timeout, or earlier to admit a new one
+                    idle = (ticks_ms(), asyncio.current_task())
+                    self.idle.append(idle)
+                    try:
+                        req = await Request.create(
+                            self, reader, writer,
+                            writer.get_extra_info('peername'))
+                    finally:
+                        if idle in self.idle:
+                            self.idle.remove(idle)
+                else:
+                    req = await Request.create(
+                        self, reader, writer,
+                        writer.get_extra_info('peername'),
+                        head_timeout=Request.head_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                break
+            except Exception as exc:  # pragma: no cover
+                print_exception(exc)
+                failed = True
+            if req is None and served and not failed:
+                break  # the client closed the persistent connection
+
+            res = await self.dispatch_request(req)
+            served += 1
+            keep_alive = req is not None and \
+                served < self.max_keepalive_requests and \
+                self._request_keep_alive(req)
+            if res != Response.already_handled:  # pragma: no branch
+                res.http_version = '1.1' if req and \
+                    req.http_version == '1.1' else '1.0'
+                res.keep_alive = keep_alive
+                if req and hasattr(res.body, '__anext__'):
+                    # the stream ends the connection, it doesn't need framing
+                    self.start_stream(req)
+                    res.keep_alive = False
+                try:
+                    await res.write(writer)
+                except Exception as exc:  # pragma: no cover
+                    print_exception(exc)
+                    res.keep_alive = False
+                keep_alive = res.keep_alive
+                if req:
+                    for handler in self.after_response_handlers:
+                        try:
+                            await self._invoke_handler(handler, req, res)
+                        except Exception as exc:  # pragma: no cover
+                            print_exception(exc)
+            else:
+                keep_alive = False
+            if self.debug and req:  # pragma: no cover
+                print('{method} {path} {status_code}'.format(
+                    method=req.method, path=req.path,
+                    status_code=res.status_code))
+            if not keep_alive:
+                break
         try:
             await writer.aclose()
         except OSError as exc:  # pragma: no cover
@@ -347,10 +854,17 @@ class Microdot(BaseMicrodot):
                 pass
             else:
                 raise
-        if self.debug and req:  # pragma: no cover
-            print('{method} {path} {status_code}'.format(
-                method=req.method, path=req.path,
-                status_code=res.status_code))
+
+    @staticmethod
+    def _request_keep_alive(req):
+        # a body that was not read into memory may still be on the wire
+        if req.content_length > Request.max_body_length or \
+                'Transfer-Encoding' in req.headers:
+            return False
+        connection = req.headers.get('Connection', '').lower()
+        if req.http_version == '1.1':
+            return 'close' not in connection
+        return 'keep-alive' in connection
 
     async def dispatch_request(self, req):
         after_request_handled = False
@@ -0,0 +1,237 @@
+"""
+microdot_asyncio_websocket
+--------------------------
+
+The ``microdot_asyncio_websocket`` module adds WebSocket support to the
+``microdot_asyncio`` web server.
+"""
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+import binascii
+import hashlib
+
+from microdot import abort
+from microdot import MUTED_SOCKET_ERRORS
+from microdot.microdot_asyncio import Response, _wait_for
+
+
+class WebSocketError(Exception):
+    """Exception raised when the WebSocket connection is closed or the
+    client sends an invalid frame."""
+    pass
+
+
+class WebSocket:
+    """A server-side WebSocket connection.
+
+    :param request: The request object that was upgraded to a WebSocket.
+    """
+    GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+    CONT = 0
+    TEXT = 1
+    BINARY = 2
+    CLOSE = 8
+    PING = 9
+    PONG = 10
+
+    #: The maximum length of a message accepted from the client. Larger
+    #: messages close the connection with status 1009.
+    max_message_length = 1024
+
+    #: The size of the buffer outgoing frames are assembled in. It is
+    #: allocated once per connection, frames with larger payloads are sent
+    #: in two writes.
+    frame_buffer_size = 256
+
+    def __init__(self, request):
+        self.request = request
+        self.reader, self.writer = request.sock
+        self.closed = False
+        self._frame = bytearray(self.frame_buffer_size)
+        # tasks sending on the same connection take turns, so that the
+        # writes of one frame are not interleaved with another's and the
+        # frame buffer is not reused while it is being sent
+        self._send_lock = asyncio.Lock()
+
+    async def handshake(self):
+        """Send the response that upgrades the connection."""
+        connection = self.request.headers.get('Connection', '').lower()
+        upgrade = self.request.headers.get('Upgrade', '').lower()
+        key = self.request.headers.get('Sec-WebSocket-Key')
+        if 'upgrade' not in connection or upgrade != 'websocket' or not key:
+            abort(400, 'Invalid WebSocket handshake')
+        accept = binascii.b2a_base64(
+            hashlib.sha1(key.encode() + self.GUID).digest())[:-1]
+        await self.writer.awrite(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        if hasattr(self.request.app, 'start_stream'):
+            self.request.app.start_stream(self.request)
+
+    async def receive(self):
+        """Return the next text (as ``str``) or binary (as ``bytes``)
+        message from the client. Control frames are handled internally.
+
+        This method is a coroutine. It raises :class:`WebSocketError` when
+        the connection is closed.
+        """
+        message = None
+        message_opcode = None
+        while True:
+            if self.closed:
+                raise WebSocketError('WebSocket connection closed')
+            try:
+                fin, opcode, payload = await self._read_frame()
+            except EOFError:
+                self.closed = True
+                raise WebSocketError('WebSocket connection closed')
+            if opcode == self.CLOSE:
+                await self.close()
+                raise WebSocketError('WebSocket connection closed')
+            elif opcode == self.PING:
+                await self.send(payload, self.PONG)
+                continue
+            elif opcode == self.PONG:
+                continue
+            elif opcode == self.CONT:
+                if message is None:
+                    raise WebSocketError('Unexpected continuation frame')
+                if len(message) + len(payload) > self.max_message_length:
+                    await self.close(1009)
+                    raise WebSocketError('Message too long')
+                message += payload
+            elif opcode in (self.TEXT, self.BINARY):
+                message = payload
+                message_opcode = opcode
+            else:
+                await self.close(1002)
+                raise WebSocketError('Invalid opcode')
+            if fin:
+                if message_opcode == self.TEXT:
+                    return bytes(message).decode()
+                return bytes(message)
+
+    async def send(self, data, opcode=None):
+        """Send a message to the client.
+
+        :param data: The message, a ``str`` is sent as a text message and
+                     bytes as a binary message.
+        :param opcode: An explicit frame opcode, used for control frames.
+
+        This method is a coroutine. A client that does not accept the
+        message within ``Response.send_timeout`` seconds is disconnected, and
+        :class:`WebSocketError` is raised.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+            opcode = opcode or self.TEXT
+        async with self._send_lock:
+            if self.closed:
+                raise WebSocketError('WebSocket connection closed')
+            try:
+                for part in self._encode_frame(opcode or self.BINARY, data):
+                    await _wait_for(self.writer.awrite(part),
+                                    Response.send_timeout)
+            except asyncio.TimeoutError:
+                # the client stopped reading, closing the socket also ends
+                # the receive loop
+                self.closed = True
+                if hasattr(self.writer, 'transport'):  # pragma: no cover
+                    # CPython would wait to send the unsent data first
+                    self.writer.transport.abort()
+                else:
+                    self.writer.close()
+                raise WebSocketError('WebSocket send timed out')
+
+    async def close(self, status=1000):
+        """Send a close frame to the client, if not done already.
+
+        This method is a coroutine.
+        """
+        if self.closed:
+            return
+        try:
+            await self.send(status.to_bytes(2, 'big'), self.CLOSE)
+        except OSError as exc:  # pragma: no cover
+            if exc.errno not in MUTED_SOCKET_ERRORS:
+                raise
+        self.closed = True
+
+    async def _read_frame(self):
+        header = await self.reader.readexactly(2)
+        if len(header) < 2:
+            raise EOFError()
+        fin = header[0] & 0x80
+        opcode = header[0] & 0x0f
+        length = header[1] & 0x7f
+        if length == 126:
+            length = int.from_bytes(await self.reader.readexactly(2), 'big')
+        elif length == 127:
+            length = int.from_bytes(await self.reader.readexactly(8), 'big')
+        if length > self.max_message_length:
+            await self.close(1009)
+            raise WebSocketError('Message too long')
+        mask = await self.reader.readexactly(4) if header[1] & 0x80 \
+            else None
+        payload = bytearray(await self.reader.readexactly(length))
+        if mask:
+            for i in range(length):
+                payload[i] ^= mask[i & 3]
+        return fin, opcode, payload
+
+    def _encode_frame(self, opcode, payload):
+        # server frames are never masked
+        buf = self._frame
+        n = len(payload)
+        buf[0] = 0x80 | opcode
+        if n < 126:
+            buf[1] = n
+            i = 2
+        elif n < 65536:
+            buf[1] = 126
+            buf[2:4] = n.to_bytes(2, 'big')
+            i = 4
+        else:
+            buf[1] = 127
+            buf[2:10] = n.to_bytes(8, 'big')
+            i = 10
+        if i + n <= len(buf):
+            buf[i:i + n] = payload
+            return (memoryview(buf)[:i + n],)
+        return (memoryview(buf)[:i], payload)
+
+
+def with_websocket(f):
+    """Decorator to make a route a WebSocket endpoint.
+
+    The decorated function receives the request and a :class:`WebSocket`
+    object, plus any URL arguments. The connection is closed when the
+    function returns.
+
+    Example::
+
+        @app.route('/echo')
+        @with_websocket
+        async def echo(request, ws):
+            while True:
+                message = await ws.receive()
+                await ws.send(message)
+    """
+    async def wrapper(request, *args, **kwargs):
+        ws = WebSocket(request)
+        await ws.handshake()
+        try:
+            await f(request, ws, *args, **kwargs)
+            await ws.close()
+        except WebSocketError:
+            pass
+        except OSError as exc:
+            if exc.errno not in MUTED_SOCKET_ERRORS:  # pragma: no cover
+                raise
+        return Response.already_handled
+    return wrapper
@@ -0,0 +1,176 @@
+"""
+microdot_sse
+------------
+
+The ``microdot_sse`` module adds Server-Sent Events support to the
+``microdot_asyncio`` web server.
+"""
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from microdot.microdot_asyncio import Response
+
+
+class Subscription:
+    """A subscriber's queue of messages, consumed as an async iterator.
+
+    MicroPython does not have async generators, so this class implements
+    the async iterator protocol directly. It can be used as the body of a
+    streaming response.
+    """
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.queue = []
+        self.event = asyncio.Event()
+        self.closed = False
+        self.watcher = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.queue:
+            if self.closed:
+                raise StopAsyncIteration
+            self.event.clear()
+            await self.event.wait()
+        return self.queue.pop(0)
+
+    def watch(self, stream):
+        """Close the subscription as soon as the client disconnects.
+
+        :param stream: The input stream of the client connection.
+
+        Without this, a client that goes away is only noticed when a
+        message fails to be written to it.
+        """
+        self.watcher = asyncio.create_task(self._watch(stream))
+
+    async def _watch(self, stream):
+        try:
+            # clients send nothing after the request, until they disconnect
+            while await stream.read(64):
+                pass
+        except Exception:  # pragma: no cover
+            pass
+        self.watcher = None
+        self.close()
+
+    def close(self):
+        """Stop the subscription. Messages already queued are still
+        returned."""
+        self.closed = True
+        if self in self.broadcaster.clients:
+            self.broadcaster.clients.remove(self)
+        if self.watcher is not None:
+            self.watcher.cancel()
+            self.watcher = None
+        self.event.set()
+
+    async def aclose(self):
+        self.close()
+
+
+class Broadcaster:
+    """Fan out pre-encoded messages to any number of subscribers.
+
+    :param max_queue: The maximum number of messages waiting to be sent to a
+                      single subscriber. A subscriber that falls further
+                      behind is evicted, and can subscribe again when it
+                      catches up.
+    :param max_clients: The maximum number of subscribers at once.
+    """
+    def __init__(self, max_queue=8, max_clients=4):
+        self.max_queue = max_queue
+        self.max_clients = max_clients
+        self.clients = []
+
+    def subscribe(self):
+        """Return a new :class:`Subscription`, or ``None`` if the maximum
+        number of subscribers has been reached."""
+        if len(self.clients) >= self.max_clients:
+            return None
+        client = Subscription(self)
+        self.clients.append(client)
+        return client
+
+    def broadcast(self, message):
+        """Queue a message for every subscriber.
+
+        :param message: The message to send. The same object is queued for
+                        all the subscribers.
+        """
+        for client in self.clients[:]:
+            if len(client.queue) >= self.max_queue:
+                # slow client, evict it rather than buffer without bound
+                del client.queue[:]
+                client.close()
+            else:
+                client.queue.append(message)
+                client.event.set()
+
+
+class EventSource(Broadcaster):
+    """A broadcaster of Server-Sent Events.
+
+    :param max_queue: The maximum number of events waiting to be sent to a
+                      single client. A client that falls further behind is
+                      disconnected, and can reconnect when it catches up.
+    :param max_clients: The maximum number of clients subscribed at once.
+                        Further clients receive a 503 response.
+
+    Example::
+
+        events = EventSource()
+
+        @app.route('/events')
+        async def stream(request):
+            return events.response(request)
+
+        events.publish({'temperature': 21.5}, event='reading')
+    """
+    def publish(self, data, event=None):
+        """Send an event to all the subscribed clients.
+
+        :param data: The event data. A dictionary or list is encoded as JSON,
+                     and a string is sent as is.
+        :param event: The optional event name.
+
+        The event is serialized once and the same bytes are queued for every
+        client.
+        """
+        if not self.clients:
+            return
+        if isinstance(data, (dict, list)):
+            data = json.dumps(data)
+        message = 'data: ' + data.replace('\n', '\ndata: ') + '\n\n'
+        if event:
+            message = 'event: ' + event + '\n' + message
+        self.broadcast(message.encode())
+
+    def response(self, request=None):
+        """Return a streaming response subscribed to this event source.
+
+        :param request: The request the response is for. If given, the
+                        client is unsubscribed as soon as it disconnects,
+                        instead of on the next event.
+        """
+        client = self.subscribe()
+        if client is None:
+            return Response('Too many event stream clients', 503)
+        if request is not None:
+            client.watch(request.sock[0])
+        # send the headers right away so that the client sees the stream
+        # open before the first event
+        client.queue.append(b': connected\n\n')
+        return Response(client, headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+        })
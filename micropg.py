@@ -28,6 +28,15 @@ import hashlib
 import socket
 import binascii
 import random
+import time
+try:
+    import threading
+except ImportError:
+    threading = None
+try:
+    import uselect as select
+except ImportError:
+    import select
 
 VERSION = (0, 3, 1)
 __version__ = '%s.%s.%s' % VERSION
@@ -302,6 +311,10 @@ class Cursor(object):
         self.description = []
         self._rows.clear()
         self.args = args
+        self.query = self._bind(query, args)
+        self.connection.execute(self.query, self)
+
+    def _bind(self, query, args):
         if args:
             escaped_args = tuple(
                 self.connection.escape_parameter(arg).replace(u'%', u'%%') for arg in args
@@ -309,8 +322,15 @@ class Cursor(object):
             query = query.replace(u'%', u'%%').replace(u'%%s', u'%s')
             query = query % escaped_args
             query = query.replace(u'%%', u'%')
-        self.query = query
-        self.connection.execute(query, self)
+        return query
+
+    def copy_out(self, query, args=()):
+        # COPY ... TO STDOUT, yields each CopyData chunk as it arrives
+        if not self.connection or not self.connection.is_connect():
+            raise ProgrammingError(u"08003:Lost connection")
+        self.args = args
+        self.query = self._bind(query, args)
+        return self.connection.copy_out(self.query)
 
     def executemany(self, query, seq_of_params):
         rowcount = 0
@@ -382,6 +402,7 @@ class Connection(object):
         self.encoders = {}
         self.tz_name = None
         self.tzinfo = None
+        self.notifications = []
         self._open()
 
     def __enter__(self):
@@ -589,44 +610,10 @@ class Connection(object):
                 obj._rows.append(tuple(row))
             elif code == 78:
                 pass
+            elif code == 65:    # NotificationResponse('A')
+                self._add_notification(data)
             elif code == 69 and not errobj:
-                err = data.split(b'\x00')
-                # http://www.postgresql.org/docs/9.3/static/errcodes-appendix.html
-                errcode = err[2][1:]
-                message = errcode + b':' + err[3][1:]
-                message = message.decode(self.encoding)
-                if errcode[:2] == b'0A':
-                    errobj = NotSupportedError(message, errcode)
-                elif errcode[:2] in (b'20', b'21'):
-                    errobj = ProgrammingError(message, errcode)
-                elif errcode[:2] in (b'22', ):
-                    errobj = DataError(message, errcode)
-                elif errcode[:2] == b'23':
-                    errobj = IntegrityError(message, errcode)
-                elif errcode[:2] in(b'24', b'25'):
-                    errobj = InternalError(message, errcode)
-                elif errcode[:2] in(b'26', b'27', b'28'):
-                    errobj = OperationalError(message, errcode)
-                elif errcode[:2] in(b'2B', b'2D', b'2F'):
-                    errobj = InternalError(message, errcode)
-                elif errcode[:2] == b'34':
-                    errobj = OperationalError(message, errcode)
-                elif errcode[:2] in (b'38', b'39', b'3B'):
-                    errobj = InternalError(message, errcode)
-                elif errcode[:2] in (b'3D', b'3F'):
-                    errobj = ProgrammingError(message, errcode)
-                elif errcode[:2] in (b'40', b'42', b'44'):
-                    errobj = ProgrammingError(message, errcode)
-                elif errcode[:1] == b'5':
-                    errobj = OperationalError(message, errcode)
-                elif errcode[:1] in b'F':
-                    errobj = InternalError(message, errcode)
-                elif errcode[:1] in b'H':
-                    errobj = OperationalError(message, errcode)
-                elif errcode[:1] in (b'P', b'X'):
-                    errobj = InternalError(message, errcode)
-                else:
-                    errobj = DatabaseError(message, errcode)
+                errobj = self._error_response(data)
             elif code == 72:    # CopyOutputResponse('H')
                 pass
             elif code == 100:   # CopyData('d')
@@ -647,11 +634,57 @@ class Connection(object):
                 pass
         return errobj
 
+    def _error_response(self, data):
+        err = data.split(b'\x00')
+        # http://www.postgresql.org/docs/9.3/static/errcodes-appendix.html
+        errcode = err[2][1:]
+        message = errcode + b':' + err[3][1:]
+        message = message.decode(self.encoding)
+        if errcode[:2] == b'0A':
+            return NotSupportedError(message, errcode)
+        elif errcode[:2] in (b'20', b'21'):
+            return ProgrammingError(message, errcode)
+        elif errcode[:2] in (b'22', ):
+            return DataError(message, errcode)
+        elif errcode[:2] == b'23':
+            return IntegrityError(message, errcode)
+        elif errcode[:2] in(b'24', b'25'):
+            return InternalError(message, errcode)
+        elif errcode[:2] in(b'26', b'27', b'28'):
+            return OperationalError(message, errcode)
+        elif errcode[:2] in(b'2B', b'2D', b'2F'):
+            return InternalError(message, errcode)
+        elif errcode[:2] == b'34':
+            return OperationalError(message, errcode)
+        elif errcode[:2] in (b'38', b'39', b'3B'):
+            return InternalError(message, errcode)
+        elif errcode[:2] in (b'3D', b'3F'):
+            return ProgrammingError(message, errcode)
+        elif errcode[:2] in (b'40', b'42', b'44'):
+            return ProgrammingError(message, errcode)
+        elif errcode[:1] == b'5':
+            return OperationalError(message, errcode)
+        elif errcode[:1] in b'F':
+            return InternalError(message, errcode)
+        elif errcode[:1] in b'H':
+            return OperationalError(message, errcode)
+        elif errcode[:1] in (b'P', b'X'):
+            return InternalError(message, errcode)
+        else:
+            return DatabaseError(message, errcode)
+
     def process_messages(self, obj):
         err = self._process_messages(obj)
         if err:
             raise err
 
+    def _add_notification(self, data):
+        pid = _bytes_to_bint(data[:4])
+        channel, payload, _ = data[4:].split(b'\x00')
+        self.notifications.append(
+            (pid, channel.decode(self.encoding), payload.decode(self.encoding))
+        )
+
     def _read(self, ln):
         if not self.sock:
             raise OperationalError(u"08003:Lost connection")
@@ -701,6 +734,9 @@ class Connection(object):
         self._write(_bint_to_bytes(len(v) + 4) + v)
         self.process_messages(None)
 
+    def escape_identifier(self, v):
+        return u'"' + v.replace(u'"', u'""') + u'"'
+
     def escape_parameter(self, v):
         t = type(v)
         func = self.encoders.get(t)
@@ -771,6 +807,74 @@ class Connection(object):
         self._rollback()
         self.begin()
 
+    def copy_out(self, query):
+        # Generator over the CopyData payloads of a COPY ... TO STDOUT, read
+        # from the socket only as the consumer asks for them.
+        self._send_message(b'Q', query.encode(self.encoding) + b'\x00')
+        errobj = None
+        done = False
+        try:
+            while True:
+                code = ord(self._read(1))
+                ln = _bytes_to_bint(self._read(4)) - 4
+                data = self._read(ln)
+                if code == 100:     # CopyData('d')
+                    yield data
+                elif code == 90:    # ReadyForQuery('Z')
+                    self._ready_for_query = data
+                    done = True
+                    break
+                elif code == 65:    # NotificationResponse('A')
+                    self._add_notification(data)
+                elif code == 69 and not errobj:
+                    errobj = self._error_response(data)
+        finally:
+            if not done and self.sock:
+                # an unfinished COPY can't be abandoned mid-stream
+                self.sock.close()
+                self.sock = None
+        if errobj:
+            raise errobj
+
+    def listen(self, channel):
+        # Notifications are only delivered to a session outside of a
+        # transaction block, so a listening connection should be dedicated
+        # to it and is left idle here.
+        if self.is_dirty:
+            self._rollback()
+        self._send_message(b'Q', (u'LISTEN ' + self.escape_identifier(channel)).encode(self.encoding) + b'\x00')
+        self.process_messages(None)
+
+    def unlisten(self, channel=None):
+        if self.is_dirty:
+            self._rollback()
+        target = self.escape_identifier(channel) if channel else u'*'
+        self._send_message(b'Q', (u'UNLISTEN ' + target).encode(self.encoding) + b'\x00')
+        self.process_messages(None)
+
+    def poll(self, timeout=0):
+        # Read the asynchronous messages that arrived while the connection
+        # was idle and return the pending (pid, channel, payload) notifications.
+        if not self.sock:
+            raise OperationalError(u"08003:Lost connection")
+        poller = select.poll()
+        poller.register(self.sock, select.POLLIN)
+        ms = int(timeout * 1000)
+        while poller.poll(ms):
+            code = ord(self._read(1))
+            ln = _bytes_to_bint(self._read(4)) - 4
+            data = self._read(ln)
+            if code == 65:      # NotificationResponse('A')
+                self._add_notification(data)
+            elif code == 69:    # ErrorResponse('E'), e.g. server shutdown
+                self.sock.close()
+                self.sock = None
+                raise OperationalError(u"08003:Lost connection")
+            ms = 0
+        notifications = self.notifications
+        self.notifications = []
+        return notifications
+
     def reopen(self):
         self.close()
         self._open()
@@ -798,4 +902,162 @@ def drop_database(database, host, user, password='', port=None, use_ssl=False):
     with connect(host, user, password, None, port, None, use_ssl) as conn:
         conn._rollback()
         conn._send_message(b'Q', 'DROP DATABASE {}'.format(database).encode('utf-8') + b'\x00')
-        conn.process_messages(None)
\ No newline at end of file
+        conn.process_messages(None)
+
+
+class _NoCondition(object):
+    # Stand-in for threading.Condition where threads are not available,
+    # acquire() never waits on it as nothing else could release a connection.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, traceback):
+        pass
+
+    def wait(self, timeout=None):
+        pass
+
+    def notify(self):
+        pass
+
+    def notify_all(self):
+        pass
+
+
+class _PooledConnection(object):
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.pool.acquire(self.timeout)
+        return self.conn
+
+    def __exit__(self, exc, value, traceback):
+        self.pool.release(self.conn)
+        self.conn = None
+
+
+class ConnectionPool(object):
+    # A bounded pool of authenticated connections, shared between threads
+    # so that each write doesn't pay for the startup and SCRAM exchange.
+    def __init__(self, host, user, password='', database=None, port=None, timeout=None, use_ssl=False,
+                 maxsize=4, idle_timeout=300, check_interval=30, autocommit=True):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.port = port
+        self.timeout = timeout
+        self.use_ssl = use_ssl
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout        # close connections idle longer than this
+        self.check_interval = check_interval    # ping connections idle longer than this on checkout
+        self.autocommit = autocommit
+        self.closed = False
+        self._idle = []     # (connection, last used), most recently used last
+        self._size = 0      # connections open or being opened, idle or checked out
+        self._cond = threading.Condition() if threading else _NoCondition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, traceback):
+        self.close()
+
+    def _connect(self):
+        conn = connect(self.host, self.user, self.password, self.database, self.port, self.timeout, self.use_ssl)
+        conn.autocommit = self.autocommit
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _reap(self):
+        # Called with the lock held, idle connections are ordered by last use
+        now = time.time()
+        expired = 0
+        while expired < len(self._idle) and now - self._idle[expired][1] > self.idle_timeout:
+            self._discard(self._idle[expired][0])
+            expired += 1
+        if expired:
+            del self._idle[:expired]
+            self._size -= expired
+
+    def _is_healthy(self, conn, last_used):
+        if not conn.is_connect():
+            return False
+        if time.time() - last_used <= self.check_interval:
+            return True
+        try:
+            conn.cursor().execute(u"SELECT 1")
+        except Exception:
+            return False
+        return True
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                if self.closed:
+                    raise InterfaceError(u"Connection pool is closed")
+                self._reap()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxsize:
+                    self._size += 1
+                    conn = last_used = None
+                    break
+                remaining = None if deadline is None else deadline - time.time()
+                if threading is None:
+                    raise OperationalError(u"08004:No pooled connection available")
+                if remaining is not None and remaining <= 0:
+                    raise OperationalError(u"08004:Timed out waiting for a pooled connection")
+                self._cond.wait(remaining)
+
+        # Connecting and health checks happen outside of the lock, the slot
+        # taken above is handed back if no working connection can be made.
+        if conn is not None:
+            if self._is_healthy(conn, last_used):
+                return conn
+            self._discard(conn)
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        if conn.is_connect() and conn._ready_for_query == b'E':
+            try:
+                conn.rollback()
+            except Exception:
+                self._discard(conn)
+        with self._cond:
+            if self.closed or not conn.is_connect():
+                self._discard(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def connection(self, timeout=None):
+        # with pool.connection() as conn: ...
+        return _PooledConnection(self, timeout)
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
@@ -3,6 +3,8 @@ import asyncio
 import logging
 from machine import Pin, ADC
 from database import Database
+from history import ReadingHistory
+from utils import metrics
 from utils import clock#, statistics
 import utils.connect as connection
 import utime
@@ -20,9 +22,16 @@ conversion = 3.4 / 65535
 trigger = Pin(0, Pin.OUT)
 echo = Pin(1, Pin.IN)
 
+# Give up on an echo after this long, about 5 m of travel there and back
+ECHO_TIMEOUT_US = 30000
+
 # logging
 logger = logging.getLogger('pico-sump')
 
+# Metrics
+read_duration = metrics.Histogram('pico_sensor_read_seconds', 'Time taken by a distance reading.')
+echo_timeouts = metrics.Counter('pico_sensor_echo_timeouts_total', 'Distance readings that got no echo in time.')
+
 # Webserver ----------------------------------------------------------------- #
 class PicoSumpSensor:
     
@@ -36,19 +45,30 @@ class PicoSumpSensor:
 
     # Current values
     timestamp = None    # Current timestamp
+    seq = 0             # Sequence number of the current reading
+    seq_reserved = 0    # Highest sequence number saved to flash
+    seq_block = 100     # Sequence numbers reserved per flash write
     distance = 0        # Current distance
     water_level = 0     # Current water level (pit_depth - distance)
+    generation = 0      # Bumped whenever readings or settings change
+    settings_generation = 0     # Bumped only when settings change
+    
+    # On demand readings
+    fresh_interval = 1000   # Readings younger than this are shared, in ms
+    echo_settle = 0.06      # Seconds to let echoes die down before a ping
+    reading_ticks = None    # utime.ticks_ms() of the current reading
+    pending_reading = None  # Event set when the in flight reading is taken
     
     # Statistics
     threshold = 999     # Threshold for triggering data log, in cm
 
     # Sensor data
-    stack = []          # List of tuples of (timestamp, distance) to analyze from
+    history = None      # ReadingHistory of (seq, timestamp, distance) to analyze from
     
     # Main program requires about 185kb of memory
-    # This leaves about 80kb for the stack minus whatever is used by momemtary web requests
+    # This leaves about 80kb for the history minus whatever is used by momemtary web requests
     # 1 hour of data or 100 readings, whichever is less
-    max_stacklength = min(3600 / heartbeat, 100)
+    max_stacklength = int(min(3600 / heartbeat, 100))
     
     # Specify the types of the settings to be validated
     types = {
@@ -64,7 +84,15 @@ class PicoSumpSensor:
     
     def __init__(self, netinfo) -> None:
         self.netinfo = netinfo
-    
+        
+        # Recent readings served to the dashboard
+        self.history = ReadingHistory(self.max_stacklength)
+        
+        # Functions called with the sensor after each new reading, and after
+        # each settings change
+        self.reading_callbacks = []
+        self.settings_callbacks = []
+        
         # Load the config file
         try:
             with open('saved_settings.json', 'r') as f:
@@ -84,6 +112,35 @@ class PicoSumpSensor:
             with open('saved_settings.json', 'w') as f:
                 f.write(ujson.dumps(settings))
         
+        # Resume the sequence after the block reserved by the previous boot,
+        # so sequence numbers never repeat for this device
+        try:
+            with open('saved_seq.txt', 'r') as f:
+                self.seq = self.seq_reserved = int(f.read())
+        except (OSError, ValueError) as e:
+            self.seq = self.seq_reserved = self.recover_seq()
+            logger.error(f"Could not read saved_seq.txt, resuming readings from seq {self.seq}. {e}")
+                
+        # Subscribe to settings pushed from the database
+        if self.db_logging:
+            Database.listen(self.settings_channel)
+        
+    def recover_seq(self):
+        # Readings reusing a logged seq would be dropped by the database as
+        # replays, so continue after the last one it has. Without the
+        # database, the clock is used as it only moves ahead of past seqs
+        if self.db_logging:
+            seq = Database.last_seq(self.sump_id)
+            if seq is not None:
+                return seq
+        
+        return clock.datetime_to_epoch(clock.get_datetime())
+    
+    @property
+    def settings_channel(self):
+        # Postgres channel that sump_settings changes are notified on
+        return f"sump_settings_{self.sump_id}"
+        
     @staticmethod
     def get_adc_temperature(verbose = False):
     
@@ -107,17 +164,24 @@ class PicoSumpSensor:
             utime.sleep_us(5)
             trigger.low()
         
-            signaloff = 0
-            signalon = 0
+            signaloff = utime.ticks_us()
+            signalon = signaloff
         
             while echo.value() == 0:
                 signaloff = utime.ticks_us()
+                if utime.ticks_diff(signaloff, signalon) > ECHO_TIMEOUT_US:
+                    raise OSError('echo timeout')
             
             while echo.value() == 1:
                 signalon = utime.ticks_us()
+                if utime.ticks_diff(signalon, signaloff) > ECHO_TIMEOUT_US:
+                    raise OSError('echo timeout')
                 
-            timepassed = signalon - signaloff
+            timepassed = utime.ticks_diff(signalon, signaloff)
             distance = (timepassed * 0.0343) / 2
+        except OSError:
+            echo_timeouts.inc()
+            distance = -999
         except:
             distance = -999
         
@@ -137,35 +201,72 @@ class PicoSumpSensor:
             
             msg += f"{key}={value}, "
    
-    def get_current_data(self, from_timestamp = None, stream = True):  
+    def get_current_readings(self, from_timestamp = None, after = None):
+        # Generator of (seq, epoch timestamp, distance) readings
         
         # If given a timestamp, convert to datetime object
         # and return only data after that timestamp     
-        if from_timestamp:
-            from_time = clock.string_to_datetime(from_timestamp)
-        else:
-            from_time = 0
+        from_time = self.parse_timestamp(from_timestamp)
+        
+        # If given a cursor, skip straight to the readings after it. The
+        # readings are copied, a slow client streams from its own snapshot
+        # while readings taken meanwhile are left for the next request
+        first = self.history.position_after(after) if after is not None else 0
+        history = self.history.copy(first)
+        
+        def readings_generator():
+            for seq, t, d in history.readings():
+                if t > from_time:
+                    yield seq, t, d
+                    
+        return readings_generator()
+    
+    def get_current_data(self, from_timestamp = None, after = None, stream = True):  
+        readings = self.get_current_readings(from_timestamp, after=after)
             
         # If streaming, create a generator to stream the data
         if stream:
             def readings_generator():
-                for t, d in self.stack:
-                    if t > from_time:
-                        timestamp = clock.datetime_to_string(t)
-                        yield f"[{timestamp}, {d}]" + "\n"
+                for seq, t, d in readings:
+                    timestamp = clock.datetime_to_string(clock.epoch_to_datetime(t))
+                    yield f"[{timestamp}, {d}]" + "\n"
                         
             return readings_generator()
         
-        # If not streaming, return the data stack as a list
+        # If not streaming, return the readings as a list
         else:
-            readings = []
-            for t, d in self.stack:
-                if t > from_time:
-                    timestamp = clock.datetime_to_string(t)
-                    readings.append((timestamp, d))
+            data = []
+            for seq, t, d in readings:
+                timestamp = clock.datetime_to_string(clock.epoch_to_datetime(t))
+                data.append((timestamp, d))
                     
-            return readings
+            return data
             
+    def get_current_columns(self, from_timestamp = None, after = None):
+        # Packed little-endian columns of the same readings as get_current_data:
+        # int32 epoch timestamps followed by float32 distances
+        if after is not None:
+            first = self.history.position_after(after)
+        else:
+            first = 0
+        
+        if from_timestamp:
+            first = max(first, self.history.position_since(self.parse_timestamp(from_timestamp)))
+        
+        return self.history.columns(first)
+    
+    @staticmethod
+    def parse_timestamp(from_timestamp):
+        # Epoch seconds of a datetime_to_string timestamp, 0 if not given
+        if not from_timestamp:
+            return 0
+        
+        from_time = clock.string_to_datetime(from_timestamp)
+        if from_time is None:
+            raise ValueError(f"Invalid timestamp {from_timestamp}")
+        
+        return clock.datetime_to_epoch(from_time)
+    
     def get_settings(self):
         return {
             'sump_id': self.sump_id,
@@ -174,16 +275,59 @@ class PicoSumpSensor:
             'heartbeat': self.heartbeat,
             'log_rate': self.log_rate,
             'threshold': self.threshold,
+            'db_logging': self.db_logging,
         }
         
-    def update_stack(self):
-        # Add to the web data stack
-        self.stack.append((self.timestamp, self.distance))
-        stacklength = len(self.stack)
+    def next_seq(self):
+        self.seq += 1
+        
+        # Reserve a block at a time to spare the flash a write per reading
+        if self.seq > self.seq_reserved:
+            self.seq_reserved = self.seq + self.seq_block
+            with open('saved_seq.txt', 'w') as f:
+                f.write(str(self.seq_reserved))
+                
+        return self.seq
+    
+    def save_settings(self):
+        with open('saved_settings.json', 'w') as f:
+            f.write(ujson.dumps(self.get_settings()))
+    
+    def check_notifications(self):
+        # Follow sump_id changes with the subscription
+        if Database.channel != self.settings_channel:
+            Database.listen(self.settings_channel)
+        
+        for pid, channel, payload in Database.poll_notifications():
+            if channel != self.settings_channel:
+                continue
+            
+            try:
+                pushed = ujson.loads(payload)
+            except ValueError:
+                logger.error(f"Invalid settings notification on {channel}: {payload}")
+                continue
+            
+            pushed = {k: self.types[k](v) for k, v in pushed.items() if k in self.types}
+            
+            # The trigger also fires for this device's own upsert, which
+            # carries the settings already in use
+            if all(getattr(self, k) == v for k, v in pushed.items()):
+                continue
+            
+            self.set_values(**pushed)
+            self.save_settings()
+            self.generation += 1
+            self.settings_generation += 1
+            
+            for callback in self.settings_callbacks:
+                callback(self)
+            
+            logger.warning(f"Applied settings pushed from database: {pushed}")
         
-        # Fixed length stack -- pop off the oldest value if too long
-        if stacklength > self.max_stacklength:
-            self.stack.pop(0)
+    def update_stack(self):
+        # Add to the web data history, the oldest reading is overwritten when full
+        self.history.append(self.seq, clock.datetime_to_epoch(self.timestamp), self.distance)
             
         return
     
@@ -202,6 +346,11 @@ class PicoSumpSensor:
             
         # Update the local settings
         self.set_values(**settings)
+        self.generation += 1
+        self.settings_generation += 1
+        
+        for callback in self.settings_callbacks:
+            callback(self)
         
         if self.db_logging:
             # Update the database
@@ -212,10 +361,61 @@ class PicoSumpSensor:
             )
 
     def reset(self):
-        # Remove all but latest reading from stack
-        self.stack = []
+        # Remove all readings from the history
+        self.history.clear()
+        self.generation += 1
         gc.collect()
     
+    def take_reading(self):
+        # Measure the distance, add it to the history and notify the
+        # callbacks. Returns the change from the previous reading
+        start = utime.ticks_us()
+        self.distance = self.get_distance()
+        read_duration.observe(utime.ticks_diff(utime.ticks_us(), start))
+        self.timestamp = clock.get_datetime()
+        self.reading_ticks = utime.ticks_ms()
+        self.next_seq()
+        self.water_level = self.pit_depth - self.distance
+        
+        last = self.history.last()
+        change = self.distance - last[2] if last else 0
+        
+        # Update the data history
+        self.update_stack()
+        self.generation += 1
+        
+        for callback in self.reading_callbacks:
+            callback(self)
+            
+        return change
+    
+    async def fresh_reading(self):
+        # Take a reading on demand. Requests made while one is being taken
+        # wait for it and share the result, and a reading taken in the last
+        # fresh_interval is returned as is
+        if (
+            self.reading_ticks is not None and
+            utime.ticks_diff(utime.ticks_ms(), self.reading_ticks) < self.fresh_interval
+        ):
+            return self.history.last()
+        
+        if self.pending_reading is not None:
+            await self.pending_reading.wait()
+            return self.history.last()
+        
+        self.pending_reading = asyncio.Event()
+        try:
+            # Let echoes from the last ping die down, requests arriving
+            # meanwhile join this reading
+            await asyncio.sleep(self.echo_settle)
+            self.take_reading()
+            logger.info(f'Fresh reading requested. Distance: {self.distance:.2f} cm')
+        finally:
+            event, self.pending_reading = self.pending_reading, None
+            event.set()
+            
+        return self.history.last()
+    
     async def read_sensors(self, loop = True):
         iter = 0
         
@@ -224,12 +424,12 @@ class PicoSumpSensor:
             # Check for network connection
             connection.check_network()
             
-            # Get temp reading & convert to Fahrenheit            
-            self.distance = self.get_distance()
-            self.timestamp = clock.get_datetime()
-            self.water_level = self.pit_depth - self.distance
+            # Apply any settings changes pushed from the database
+            if self.db_logging:
+                self.check_notifications()
             
-            change = self.distance - self.stack[-1][1] if self.stack else 0
+            # Get a distance reading and add it to the history
+            change = self.take_reading()
             
             # Print to console
             mem_free = 100 * (1 - (gc.mem_free() / 1024 / 264)) # type: ignore
@@ -248,9 +448,6 @@ class PicoSumpSensor:
             
             logger.info(' '.join(msg))
             
-            # Update the data stack
-            self.update_stack()
-            
             # Log to database if change > threshold
             if change > self.threshold:
                 logger.warning(f"Detected change > {self.threshold} cm. Logging to database.")
@@ -260,16 +457,15 @@ class PicoSumpSensor:
                 self.db_logging and 
                 (change > self.threshold or iter * self.heartbeat >= self.log_rate)
             ):
-                timestamp_str = clock.datetime_to_string(self.timestamp)
-                
                 await Database.log_data(
                     sump_id=self.sump_id,
-                    timestamp=timestamp_str,
+                    seq=self.seq,
+                    timestamp=clock.datetime_to_epoch(self.timestamp),
                     distance=self.distance
                 )
                 iter = 0
             
-            gc.collect()
+            metrics.collect_garbage()
             
             # If single reading requested, return
             if not loop:
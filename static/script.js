@@ -9,6 +9,24 @@ function updateSettings() {
   var threshold = document.getElementById('threshold').value;
   var dbLogging = document.getElementById('dbLogging').checked;
   
+  // Send the settings over the live connection if it is open, the server
+  // pushes the new settings back to every dashboard
+  if (socket && socket.readyState === WebSocket.OPEN) {
+    socket.send(JSON.stringify({
+      type: 'settings',
+      settings: {
+        sump_id: sumpId,
+        alarm_level: alarmLevel,
+        pit_depth: pitDepth,
+        log_rate: logRate,
+        heartbeat: readingRate,
+        threshold: threshold,
+        db_logging: dbLogging,
+      },
+    }));
+    return;
+  }
+
   // Construct a FormData object to send the data as form data with application/x-www-form-urlencoded encoding
   const formData = new FormData();
   formData.append('sump_id', sumpId);
@@ -50,183 +68,289 @@ function clearLocalStorage() {
     .catch(error => console.error('Error resetting:', error));
 }
 
+// Readings shown on the plot, oldest first
+var timestamps = [];
+var distances = [];
+var settings = {};
+
+// Sequence number of the latest reading shown, sent back as ?after= so the
+// sensor only returns newer readings
+var lastSeq = null;
+
+// Same length as the sensor's history buffer
+const maxReadings = 100;
+
+function applySettings(settingsJSON) {
+  settings = settingsJSON;
+
+  // Extract fields from the fetched settings data
+  var pitDepth = settingsJSON.pit_depth || 999;
+  var alarmLevel = settingsJSON.alarm_level || 0;
+  var sumpId = settingsJSON.sump_id || "Unknown";
+  var logRate = settingsJSON.log_rate || 15*3600;
+  var readingRate = settingsJSON.heartbeat || 10;
+  var dbLogging = settingsJSON.db_logging || false;
+
+  // Add sumpid, pit depth, and alarm level to the HTML elements
+  document.getElementById('sumpId').value = sumpId;
+  document.getElementById('pitDepth').value = pitDepth;
+  document.getElementById('alarmLevel').value = alarmLevel;
+  document.getElementById('logRate').value = logRate;
+  document.getElementById('readingRate').value = readingRate;
+  document.getElementById('threshold').value = settingsJSON.threshold || 1;
+  document.getElementById('dbLogging').checked = dbLogging;
+}
+
+// Strip the UTC offset, the plot shows the sensor's local time
+function localTimestamp(timestamp) {
+  return timestamp.replace(/\s[-+]\d+:\d+$/, '');
+}
+
+function pushReading(timestamp, distance) {
+  timestamps.push(localTimestamp(timestamp));
+  distances.push(distance);
+
+  if (timestamps.length > maxReadings) {
+    timestamps.shift();
+    distances.shift();
+  }
+}
+
+function addReading(reading) {
+  // Skip readings already fetched from /data
+  if (lastSeq !== null && reading.seq <= lastSeq) {
+    return;
+  }
+  lastSeq = reading.seq;
+
+  pushReading(reading.timestamp, reading.distance);
+  drawPlot();
+}
+
+// Format epoch seconds in the sensor's UTC offset, like its text timestamps
+function sensorTimestamp(epoch, utcOffset) {
+  return new Date((epoch + utcOffset * 3600) * 1000).toISOString().slice(0, 19).replace('T', ' ');
+}
+
+// Fetch readings in the binary /data format: little-endian int32 epoch
+// seconds for every reading, followed by float32 distances
+function fetchReadings(query) {
+  return fetch('/data?format=bin' + query)
+  .then(response => {
+    const cursor = response.headers.get('X-Data-Cursor');
+    const utcOffset = parseInt(response.headers.get('X-UTC-Offset') || '0');
+
+    return response.arrayBuffer().then(buffer => {
+      const view = new DataView(buffer);
+      const count = buffer.byteLength / 8;
+
+      for (let i = 0; i < count; i++) {
+        pushReading(
+          sensorTimestamp(view.getInt32(4 * i, true), utcOffset),
+          view.getFloat32(4 * (count + i), true)
+        );
+      }
+      return cursor === null ? lastSeq : parseInt(cursor);
+    });
+  });
+}
+
+// Fetch the readings missed while the live connection was down
+function backfill() {
+  if (lastSeq === null) {
+    return;
+  }
+
+  fetchReadings('&after=' + lastSeq)
+  .then(cursor => {
+    lastSeq = Math.max(lastSeq, cursor);
+    drawPlot();
+  })
+  .catch(error => console.error('Error fetching data:', error));
+}
+
+// Draw the settings and readings the sensor inlined in the page, in the
+// compact form of the binary /data format
+function loadInitialState(state) {
+  applySettings(state.settings);
+
+  timestamps = [];
+  distances = [];
+  for (let i = 0; i < state.epochs.length; i++) {
+    pushReading(sensorTimestamp(state.epochs[i], state.utc_offset), state.distances[i]);
+  }
+  lastSeq = state.cursor;
+
+  drawPlot();
+}
+
 function updatePlot() {
   // Fetch sump_id, pit_depth, alarm_level from /settings endpoint  
-  // Fetch streaming data from /data endpoint with the format [[timestamp, distance], ...]
+  // Fetch the readings from the /data endpoint in binary columns
   const settings_request = fetch('/settings').then(response => response.json());
-  const data_request = fetch('/data').then(response => response.text());
+
+  timestamps = [];
+  distances = [];
+  const data_request = fetchReadings('');
 
   Promise.all([settings_request, data_request])
-  .then(([settingsJSON, dataString]) => {
-    // Extract fields from the fetched settings data
-    var pitDepth = settingsJSON.pit_depth || 999;
-    var alarmLevel = settingsJSON.alarm_level || 0;
-    var sumpId = settingsJSON.sump_id || "Unknown";
-    var logRate = settingsJSON.log_rate || 15*3600;
-    var readingRate = settingsJSON.heartbeat || 10;
-    var dbLogging = settingsJSON.db_logging || false;
-
-    // Add sumpid, pit depth, and alarm level to the HTML elements
-    document.getElementById('sumpId').value = sumpId;
-    document.getElementById('pitDepth').value = pitDepth;
-    document.getElementById('alarmLevel').value = alarmLevel;
-    document.getElementById('logRate').value = logRate;
-    document.getElementById('readingRate').value = readingRate;
-    document.getElementById('threshold').value = settingsJSON.threshold || 1;
-    document.getElementById('dbLogging').checked = dbLogging;
-
-    // Define regular expression patterns for extracting timestamps and distances
-    const timestampPattern = /\[(.*?)\s-\d+:\d+\s*,\s*([0-9.]+)\]/g;
-
-    // Arrays to store timestamps and distances
-    const timestamps = [];
-    const distances = [];
-
-    // Extract matches using the regular expression
-    let match;
-    while ((match = timestampPattern.exec(dataString)) !== null) {
-      timestamps.push(match[1]);
-      distances.push(parseFloat(match[2]));
-    }
-    
-    // Calculate the max and min distances
-    var maxDistance = Math.max(...distances);
-    var minDistance = Math.min(...distances);
-    var latestWaterLevel = pitDepth - distances[distances.length - 1];
-    var latestTimestamp = timestamps[timestamps.length - 1];
-
-    // Round the values to 2 decimal places
-    latestWaterLevel = Math.round(latestWaterLevel * 100) / 100;
-    maxDistance = Math.round(maxDistance * 100) / 100;
-    minDistance = Math.round(minDistance * 100) / 100;
-
-    document.getElementById('maxDistance').innerHTML = maxDistance || 0;
-    document.getElementById('minDistance').innerHTML = minDistance || 0;
-    document.getElementById('latestWaterLevel').innerHTML = latestWaterLevel || 0;
-    document.getElementById('latestTimestamp').innerHTML = latestTimestamp || 0;
-
-    // Convert timestamps from string to Date objects
-    // timestamps = timestamps.map(timestamp => new Date(timestamp));
-
-    // Water level is the pit depth minus the distance
-    var waterLevels = distances.map(distance => pitDepth - distance);
-
-    // Create the time series mountain plot
-    var trace = {
-      x: timestamps,
-      y: waterLevels,
-      type: 'scatter',
-      mode: 'lines',
-      fill: 'tozeroy',
-      line: {
-        color: 'rgb(0, 100, 255)',
-      },
-      name: 'Sump Water Levels',
-    };
+  .then(([settingsJSON, cursor]) => {
+    applySettings(settingsJSON);
+    lastSeq = cursor;
 
+    drawPlot();
+  })
+  .catch(error => console.error('Error fetching data:', error));
+}
 
-    var layout = {
-      xaxis: {
-        title: {
-          // text: 'Timestamp',
-          font: {
-            color: 'white',  // X-axis title text color
-          },
-        },
-        tickfont: {
-          color: 'white',  // Tick label text color
+function drawPlot() {
+  var pitDepth = settings.pit_depth || 999;
+  var alarmLevel = settings.alarm_level || 0;
+
+  // Calculate the max and min distances
+  var maxDistance = Math.max(...distances);
+  var minDistance = Math.min(...distances);
+  var latestWaterLevel = pitDepth - distances[distances.length - 1];
+  var latestTimestamp = timestamps[timestamps.length - 1];
+
+  // Round the values to 2 decimal places
+  latestWaterLevel = Math.round(latestWaterLevel * 100) / 100;
+  maxDistance = Math.round(maxDistance * 100) / 100;
+  minDistance = Math.round(minDistance * 100) / 100;
+
+  document.getElementById('maxDistance').innerHTML = maxDistance || 0;
+  document.getElementById('minDistance').innerHTML = minDistance || 0;
+  document.getElementById('latestWaterLevel').innerHTML = latestWaterLevel || 0;
+  document.getElementById('latestTimestamp').innerHTML = latestTimestamp || 0;
+
+  // Water level is the pit depth minus the distance
+  var waterLevels = distances.map(distance => pitDepth - distance);
+
+  // Create the time series mountain plot
+  var trace = {
+    x: timestamps,
+    y: waterLevels,
+    type: 'scatter',
+    mode: 'lines',
+    fill: 'tozeroy',
+    line: {
+      color: 'rgb(0, 100, 255)',
+    },
+    name: 'Sump Water Levels',
+  };
+
+
+  var layout = {
+    xaxis: {
+      title: {
+        // text: 'Timestamp',
+        font: {
+          color: 'white',  // X-axis title text color
         },
-        tickformat: '%I:%M %p', // Format as HH:MM in 12-hour format
-        showgrid: true,  // Display grid lines on the x-axis
-        gridcolor: 'gray',  // Set grid lines color
       },
-      yaxis: {
-        title: {
-          text: 'Distance to water (cm)',
-          font: {
-            color: 'white',  // Y-axis title text color
-          },
-        },
-        tickfont: {
-          color: 'white',  // Y-axis tick label text color
-        },
-        showgrid: true,  // Display grid lines on the y-axis
-        gridcolor: 'gray',  // Set grid lines color
+      tickfont: {
+        color: 'white',  // Tick label text color
       },
-      legend: {
+      tickformat: '%I:%M %p', // Format as HH:MM in 12-hour format
+      showgrid: true,  // Display grid lines on the x-axis
+      gridcolor: 'gray',  // Set grid lines color
+    },
+    yaxis: {
+      title: {
+        text: 'Distance to water (cm)',
         font: {
-          color: 'white',  // Legend font color
+          color: 'white',  // Y-axis title text color
         },
-        // x: 0,   // Set x to 0 for left alignment
-        // y: 1.2, // Set y to -0.2 for below the chart
       },
-      paper_bgcolor: 'rgba(0,0,0,0.1)',  // Transparent background color of the chart
-      plot_bgcolor: 'rgba(0,0,0,0)',     // Transparent background color of the plot area
-      shapes: [
-      // Create a trace for the alarmLevel horizontal line
-      {
-        type: 'line',
-        x0: timestamps[0],
-        x1: timestamps[timestamps.length - 1],
-        y0: alarmLevel,
-        y1: alarmLevel,
-        line: {
-            color: 'red',
-            width: 2,
-            dash: 'dash',
-        },
-        name: 'Alarm Level',
+      tickfont: {
+        color: 'white',  // Y-axis tick label text color
       },
-      // Create a trace for the pitDepth horizontal line
-      {
-        type: 'line',
-        x0: timestamps[0],
-        x1: timestamps[timestamps.length - 1],
-        y0: pitDepth,
-        y1: pitDepth,
-        line: {
-            color: 'green',
-            width: 2,
-            dash: 'dash',
-        },
-        name: 'Pit Depth',
-      }
-    ]
-    };
-
-    // Combine traces and layout, and create the plot      
-    const plotData = [trace]//, alarmLevelLine, pitDepthLine];
+      showgrid: true,  // Display grid lines on the y-axis
+      gridcolor: 'gray',  // Set grid lines color
+    },
+    legend: {
+      font: {
+        color: 'white',  // Legend font color
+      },
+      // x: 0,   // Set x to 0 for left alignment
+      // y: 1.2, // Set y to -0.2 for below the chart
+    },
+    paper_bgcolor: 'rgba(0,0,0,0.1)',  // Transparent background color of the chart
+    plot_bgcolor: 'rgba(0,0,0,0)',     // Transparent background color of the plot area
+    shapes: [
+    // Create a trace for the alarmLevel horizontal line
+    {
+      type: 'line',
+      x0: timestamps[0],
+      x1: timestamps[timestamps.length - 1],
+      y0: alarmLevel,
+      y1: alarmLevel,
+      line: {
+          color: 'red',
+          width: 2,
+          dash: 'dash',
+      },
+      name: 'Alarm Level',
+    },
+    // Create a trace for the pitDepth horizontal line
+    {
+      type: 'line',
+      x0: timestamps[0],
+      x1: timestamps[timestamps.length - 1],
+      y0: pitDepth,
+      y1: pitDepth,
+      line: {
+          color: 'green',
+          width: 2,
+          dash: 'dash',
+      },
+      name: 'Pit Depth',
+    }
+  ]
+  };
 
-    // Use Plotly to create or update the plot
-    Plotly.newPlot('time-series-plot', plotData, layout);
+  // Combine traces and layout, and create the plot      
+  const plotData = [trace]//, alarmLevelLine, pitDepthLine];
 
-    // User input for alarm level and pit depth
-    var alarmLevelInput = document.getElementById('alarmLevel');
-    var alarmLevel = parseFloat(alarmLevelInput.value);
+  // Use Plotly to create or update the plot
+  Plotly.react('time-series-plot', plotData, layout);
+}
 
-    var pitDepthInput = document.getElementById('pitDepth');
-    var pitDepth = parseFloat(pitDepthInput.value);
+// Live connection to the sensor, used for readings and settings updates
+var socket = null;
 
-    var sumpIdInput = document.getElementById('sumpId');
-    var sumpId = sumpIdInput.value;
+function connectSocket() {
+  const scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+  socket = new WebSocket(scheme + location.host + '/ws');
 
-    // The logging interval, unless trigger is met
-    var logRateInput = document.getElementById('logRate');
-    var logRate = parseFloat(logRateInput.value);
+  socket.addEventListener('message', event => {
+    const message = JSON.parse(event.data);
 
-    // The reading interval
-    var readingRateInput = document.getElementById('readingRate');
-    var readingRate = parseFloat(readingRateInput.value);
+    if (message.type === 'reading') {
+      addReading(message.reading);
+    } else if (message.type === 'settings') {
+      applySettings(message.settings);
+      drawPlot();
+    } else if (message.type === 'error') {
+      console.error('Error updating settings:', message.message);
+    }
+  });
 
-    // Turn on or off database logging
-    var dbLogging = document.getElementById('dbLogging');
+  // Catch up on readings taken while disconnected
+  socket.addEventListener('open', event => backfill());
 
-  })
-  .catch(error => console.error('Error fetching data:', error));
+  // Reconnect after a pause if the sensor drops the connection
+  socket.addEventListener('close', event => {
+    socket = null;
+    setTimeout(connectSocket, 5000);
+  });
 }
 
-// Call the updatePlot function initially
-updatePlot();
-
-// Set up an interval to update the plot every min
-setInterval(updatePlot, 60 * 1000);
\ No newline at end of file
+// Load the history once, from the page if the sensor inlined it, then
+// follow the live readings
+if (window.initialState) {
+  loadInitialState(window.initialState);
+} else {
+  updatePlot();
+}
+connectSocket();
@@ -0,0 +1,102 @@
+# Autogenerated file
+def render(state):
+    yield """<!DOCTYPE html>
+<html lang=\"en\">
+<head>
+  <meta charset=\"UTF-8\">
+  <meta name=\"viewport\" content=\"width=device-width, initial-scale=1.0\">
+  <!-- Include Bootstrap CSS with Darkly theme -->
+  <link href=\"https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css\" rel=\"stylesheet\">
+  <script src=\"https://cdn.plot.ly/plotly-latest.min.js\"></script>
+  <!-- Settings and readings inlined by the sensor, so the page can be drawn
+       without fetching /settings and /data first -->
+  <script type=\"text/javascript\">window.initialState = """
+    yield str(state)
+    yield """;</script>
+  <script type=\"text/javascript\" src=\"static/script.js\" defer></script>
+  
+  <title>Sump Sensor Portal</title>
+  <style>
+    body """
+    yield """{
+      background-color: #212529; /* Dark background color */
+      color: white; /* Text color */
+    }
+    .container """
+    yield """{
+      max-width: 100%;
+    }
+  </style>
+</head>
+<body>
+
+<div class=\"container mt-4\">
+  <div id=\"sump-id\"></div>
+  <div id=\"time-series-plot\"></div>    
+</div>
+
+<div class=\"container mt-4\">
+  <div class=\"row\">
+    <div class=\"col-md-6 col-sm-12\">
+      <label for=\"pitDepth\" style=\"color: white;\">Set pit depth:</label>
+      <input type=\"number\" id=\"pitDepth\" value=\"\" style=\"color: black; width: 4em;\">
+    </div>
+  </div>
+
+  <div class=\"row\">
+    <div class=\"col-md-6 col-sm-12\">
+      <label for=\"alarmLevel\" style=\"color: white;\">Set alarm level:</label>
+      <input type=\"number\" id=\"alarmLevel\" value=\"\" style=\"color: black; width: 4em;\">
+    </div>
+  </div>
+  
+  <div class=\"row\">
+    <div class=\"col-md-6 col-sm-12\">
+      <label for=\"logRate\" style=\"color: white;\">Set log interval:</label>
+      <input type=\"number\" id=\"logRate\" value=\"\" style=\"color: black; width: 4em;\">
+    </div>
+  </div>
+
+  <div class=\"row\">
+    <div class=\"col-md-6 col-sm-12\">
+      <label for=\"readingRate\" style=\"color: white;\">Set update interval:</label>
+      <input type=\"number\" id=\"readingRate\" value=\"\" style=\"color: black; width: 4em;\">
+    </div>
+  </div>
+
+  <div class=\"row\">
+    <div class=\"col-md-6 col-sm-12\">
+      <label for=\"threshold\" style=\"color: white;\">Set reading threshold:</label>
+      <input type=\"number\" id=\"threshold\" value=\"\" style=\"color: black; width: 4em;\">
+    </div>
+  </div>
+  
+  <div class=\"row\">
+    <div class=\"col-md-6 col-sm-12\">
+      <label for=\"sumpId\" style=\"color: white;\">Set sump ID:</label>
+      <input type=\"text\" id=\"sumpId\" value=\"\" style=\"color: black; width: 26em;\">
+    </div>
+  </div>
+
+  <div class=\"row\">
+    <div class=\"col-md-6 col-sm-12\">
+      <label for=\"dbLogging\" style=\"color: white;\">Enable database logging:</label>
+      <input type=\"checkbox\" id=\"dbLogging\" value=\"\">
+    </div>
+  </div>  
+
+  
+  <button onclick=\"updateSettings()\" class=\"btn btn-primary mt-2\">Update</button>
+  <button onclick=\"clearLocalStorage()\" class=\"btn btn-danger mt-2\">Clear Cache</button>
+
+
+  <div class=\"container mt-4\">
+    <p>Latest Water Level: <span id=\"latestWaterLevel\"></span> cm at <span id=\"latestTimestamp\"></span></p>
+    <p>Maximum measured distance: <span id=\"maxDistance\"></span> cm</p>
+    <p>Minimum measured distance: <span id=\"minDistance\"></span> cm</p>
+  </div>
+
+</div>
+
+</body>
+</html>"""
@@ -0,0 +1,101 @@
+import ujson
+import hashlib
+import binascii
+from microdot.microdot_asyncio import Response
+
+# Encoded responses for routes whose output only changes with the sensor
+# state. Each entry is stamped with a generation counter of the sensor,
+# bumped on every change of the state it depends on, so an entry is reused
+# for as long as its stamp is current. Entries are grouped by the counter
+# they are stamped with, and storing an entry drops the entries of its group
+# that are out of date, rather than keeping them until they are the least
+# recently used. Clients revalidate with the ETag and get a bodiless 304 if
+# nothing changed.
+MAX_ENTRIES = 8     # Least recently used entries are dropped beyond this
+
+# Cache of key -> (group, generation, etag, body, headers)
+_entries = {}
+_order = []         # Keys, least recently used first
+
+
+def _lookup(key, group, generation):
+    entry = _entries.get(key)
+    if entry is None or entry[0] != group or entry[1] != generation:
+        return None
+
+    _order.remove(key)
+    _order.append(key)
+
+    return entry
+
+
+def _store(key, entry):
+    # Entries of the same group from another generation can't be served again
+    for old in [k for k in _order if _entries[k][0] == entry[0] and _entries[k][1] != entry[1]]:
+        _order.remove(old)
+        del _entries[old]
+    
+    if key in _entries:
+        _order.remove(key)
+    elif len(_order) >= MAX_ENTRIES:
+        del _entries[_order.pop(0)]
+
+    _entries[key] = entry
+    _order.append(key)
+
+
+def encode_body(body):
+    # Render a route's body to bytes, once, so it can be sent many times
+    if isinstance(body, (dict, list)):
+        return ujson.dumps(body).encode()
+    if isinstance(body, str):
+        return body.encode()
+    if isinstance(body, (bytes, bytearray)):
+        return body
+
+    # Generator or list of memoryviews, joined into a single buffer
+    parts = [part.encode() if isinstance(part, str) else part for part in body]
+    buf = bytearray(sum(len(part) for part in parts))
+    i = 0
+    for part in parts:
+        buf[i:i + len(part)] = part
+        i += len(part)
+
+    return buf
+
+
+def cached_response(request, generation, render, key=None, group='readings'):
+    # render() returns the body, or a (body, headers) tuple, and is only
+    # called when there is no current entry for the key (the request URL by
+    # default, so query arguments are part of it). generation is the counter
+    # of the group the response depends on
+    key = key or request.url
+    entry = _lookup(key, group, generation)
+
+    if entry is None:
+        rendered = render()
+        body, headers = rendered if isinstance(rendered, tuple) else (rendered, {})
+
+        headers = dict(headers)
+        if 'Content-Type' not in headers:
+            headers['Content-Type'] = 'application/json; charset=UTF-8' \
+                if isinstance(body, (dict, list)) else Response.default_content_type
+
+        body = encode_body(body)
+        etag = '"' + binascii.hexlify(hashlib.sha256(body).digest()[:8]).decode() + '"'
+        headers['ETag'] = etag
+        headers['Cache-Control'] = 'no-cache'
+
+        entry = (group, generation, etag, body, headers)
+        _store(key, entry)
+
+    group, generation, etag, body, headers = entry
+
+    # Browser copy is still current
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(body=None, status_code=304, headers=dict(headers))
+
+    headers = dict(headers)
+    headers['Content-Length'] = str(len(body))
+
+    return Response(body=body, headers=headers)
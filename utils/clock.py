@@ -3,6 +3,8 @@ import ntptime
 import logging
 
 UTC_OFFSET = -8 # Pacific Standard Time (PST)
+TIMEZONE = 'America/Los_Angeles' # Zone of UTC_OFFSET, daylight saving included
+EPOCH_OFFSET = 0 if utime.gmtime(0)[0] == 1970 else 946684800 # Ports with a 2000 epoch
 ntptime.host = "0.us.pool.ntp.org"
 
 logger = logging.getLogger('pico-sump')
@@ -15,26 +17,40 @@ def get_datetime():
 def datetime_to_string(datetime_seconds):    
     # Convert to a string
     dt = utime.localtime(datetime_seconds)
-    date_string = f"{dt[0]}-{dt[1]}-{dt[3]} {dt[3]:02d}:{dt[4]:02d}:{dt[5]:02d} {UTC_OFFSET:+03d}:00"
+    date_string = f"{dt[0]}-{dt[1]:02d}-{dt[2]:02d} {dt[3]:02d}:{dt[4]:02d}:{dt[5]:02d} {UTC_OFFSET:+03d}:00"
 
     return date_string
 
 
+def datetime_to_epoch(datetime_seconds):
+    # Convert local device seconds to Unix epoch seconds (UTC)
+    return datetime_seconds - UTC_OFFSET * 3600 + EPOCH_OFFSET
+
+
+def epoch_to_datetime(epoch_seconds):
+    # Convert Unix epoch seconds (UTC) back to local device seconds
+    return epoch_seconds + UTC_OFFSET * 3600 - EPOCH_OFFSET
+
+
 def get_datetime_string():
     return datetime_to_string(utime.time() + UTC_OFFSET * 3600)
 
 
 def string_to_datetime(datetime_string):    
-    # Convert to a datetime object assuming format: "mm/dd/yyyy hh:mm:ss-UTC_OFFSET"
+    # Convert to local device seconds assuming the format from datetime_to_string: "yyyy-mm-dd hh:mm:ss +hh:00"
     try:
-        strings = datetime_string.split(' ')
-        date = strings[0].split('/')
+        strings = datetime_string.strip().split(' ')
+        date = strings[0].split('-')
         time = strings[1].split(':')
         
         # Make time [year, month, day, hour, minute, second]
-        dt = tuple([int(date[2]), int(date[0]), int(date[1]), int(time[0]), int(time[1]), int(time[2]), 1, 1])                
+        dt = tuple([int(date[0]), int(date[1]), int(date[2]), int(time[0]), int(time[1]), int(time[2]), 0, 0])                
         dt = utime.mktime(dt)
         
+        # Shift timestamps given in another UTC offset to the device's
+        if len(strings) > 2:
+            dt -= (int(strings[2].split(':')[0]) - UTC_OFFSET) * 3600
+        
     except:
         dt = None
     
@@ -0,0 +1,186 @@
+import gc
+import utime
+import asyncio
+from array import array
+
+# Counters, gauges and histograms exposed in the Prometheus text format.
+# Every line prefix (metric name and labels) is encoded once when a metric
+# is created, and values live in preallocated integer arrays, so recording
+# a value does not allocate. Histograms record durations in microseconds
+# and are exposed in seconds.
+
+# Microsecond bucket bounds, from 100 us to 10 s
+DURATION_BUCKETS = (100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000, 10000000)
+
+_metrics = []       # Registration order, metrics sharing a name are grouped
+_collectors = []    # Called before each scrape to refresh gauges
+
+
+def _labels(labels, extra=None):
+    # Render {a="1",b="2"} from a dict, in a fixed order
+    pairs = [f'{k}="{v}"' for k, v in sorted(labels.items())] if labels else []
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=None):
+        self.name = name
+        self.header = f'# HELP {name} {help}\n# TYPE {name} {self.kind}\n'.encode()
+        self.prefix = f'{name}{_labels(labels)} '.encode()
+        _metrics.append(self)
+
+    def lines(self):
+        # Yield the sample lines of this metric
+        yield self.prefix
+        yield str(self.value[0]).encode()
+        yield b'\n'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=None):
+        super().__init__(name, help, labels)
+        self.value = array('l', [0])
+
+    def inc(self, n=1):
+        self.value[0] += n
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=None):
+        super().__init__(name, help, labels)
+        self.value = array('l', [0])
+
+    def set(self, value):
+        self.value[0] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=None, buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self.counts = array('l', [0] * (len(buckets) + 1))  # Last is +Inf
+        self.total = array('l', [0, 0])  # Sum as seconds, microseconds
+
+        bounds = [str(bound / 1000000) for bound in buckets] + ['+Inf']
+        self.bucket_prefixes = [
+            (name + '_bucket' + _labels(labels, 'le="' + bound + '"') + ' ').encode()
+            for bound in bounds
+        ]
+        self.sum_prefix = f'{name}_sum{_labels(labels)} '.encode()
+        self.count_prefix = f'{name}_count{_labels(labels)} '.encode()
+
+    def observe(self, us):
+        # Record a duration in microseconds
+        i = 0
+        for bound in self.buckets:
+            if us <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+
+        # Carry whole seconds so the microsecond part stays a small int
+        total = self.total
+        total[1] += us
+        if total[1] >= 1000000:
+            total[0] += total[1] // 1000000
+            total[1] %= 1000000
+
+    def count(self):
+        return sum(self.counts)
+
+    def mean(self):
+        # Mean observation in microseconds
+        count = self.count()
+        return (self.total[0] * 1000000 + self.total[1]) // count if count else 0
+
+    def quantile(self, q):
+        # Upper bound in microseconds of the bucket the q-quantile falls in,
+        # None if it is past the largest bucket
+        rank = q * self.count()
+        count = 0
+        for bound, n in zip(self.buckets, self.counts):
+            count += n
+            if count and count >= rank:
+                return bound
+        return None
+
+    def lines(self):
+        count = 0
+        for prefix, n in zip(self.bucket_prefixes, self.counts):
+            count += n
+            yield prefix
+            yield str(count).encode()
+            yield b'\n'
+        yield self.sum_prefix
+        yield f'{self.total[0]}.{self.total[1]:06d}\n'.encode()
+        yield self.count_prefix
+        yield str(count).encode()
+        yield b'\n'
+
+
+def register_collector(collector):
+    # collector() is called before each scrape, to set gauges that are
+    # cheaper to read on demand than to keep up to date
+    _collectors.append(collector)
+
+
+def exposition():
+    # Generator of the metrics in the Prometheus text format
+    for collector in _collectors:
+        collector()
+
+    seen = set()
+    for metric in _metrics:
+        if metric.name in seen:
+            continue
+        seen.add(metric.name)
+
+        yield metric.header
+        for other in _metrics:
+            if other.name == metric.name:
+                yield from other.lines()
+
+
+# Built-in metrics ------------------------------------------------------------ #
+mem_free = Gauge('pico_mem_free_bytes', 'Free heap memory.')
+gc_pause = Histogram('pico_gc_pause_seconds', 'Time spent in gc.collect().')
+loop_lag = Histogram('pico_event_loop_lag_seconds', 'Delay of event loop wakeups past their deadline.')
+
+
+def _collect_memory():
+    if hasattr(gc, 'mem_free'):
+        mem_free.set(gc.mem_free())
+
+
+register_collector(_collect_memory)
+
+
+def collect_garbage():
+    # gc.collect(), timed
+    start = utime.ticks_us()
+    gc.collect()
+    gc_pause.observe(utime.ticks_diff(utime.ticks_us(), start))
+
+
+async def monitor_loop_lag(interval_ms=100):
+    # Sleep repeatedly and record how late each wakeup is, which is how long
+    # other tasks held the event loop. CPython's asyncio has no sleep_ms
+    sleep_ms = getattr(asyncio, 'sleep_ms', None)
+    while True:
+        start = utime.ticks_us()
+        if sleep_ms:
+            await sleep_ms(interval_ms)
+        else:
+            await asyncio.sleep(interval_ms / 1000)
+        late = utime.ticks_diff(utime.ticks_us(), start) - interval_ms * 1000
+        loop_lag.observe(late if late > 0 else 0)
@@ -0,0 +1,85 @@
+import os
+import hashlib
+import binascii
+from microdot.microdot_asyncio import Response
+
+# Files are served from flash in Response.send_file_buffer_size chunks.
+# A gzip-precompressed variant (e.g. static/script.js.gz, made on the host
+# with `gzip -k -9 static/script.js`) is sent instead to clients that accept
+# it, and strong ETags let repeat loads be answered with a bodiless 304.
+STATIC_DIR = 'static'
+MAX_AGE = 0     # Seconds browsers may skip revalidation, 0 always revalidates
+
+# Cache of file name -> (size, etag), hashed once per file
+_etags = {}
+
+
+def file_size(filename):
+    # Returns None if the file does not exist
+    try:
+        return os.stat(filename)[6]
+    except OSError:
+        return None
+
+
+def file_etag(filename, size):
+    cached = _etags.get(filename)
+    if cached and cached[0] == size:
+        return cached[1]
+    
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            buf = f.read(Response.send_file_buffer_size)
+            if not buf:
+                break
+            h.update(buf)
+            
+    etag = '"' + binascii.hexlify(h.digest()[:8]).decode() + '"'
+    _etags[filename] = (size, etag)
+    
+    return etag
+
+
+def send_static(request, path, max_age=MAX_AGE):
+    if ".." in path:
+        # directory traversal is not allowed
+        return "Not found", 404
+    
+    filename = f"{STATIC_DIR}/{path}"
+    
+    # Prefer the precompressed variant if there is one
+    gz_size = file_size(filename + '.gz')
+    compressed = gz_size is not None and \
+        'gzip' in request.headers.get('Accept-Encoding', '')
+    
+    if compressed:
+        size = gz_size
+        etag = file_etag(filename + '.gz', size)
+    else:
+        size = file_size(filename)
+        if size is None:
+            return "Not found", 404
+        etag = file_etag(filename, size)
+    
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'max-age={max_age}',
+    }
+    if gz_size is not None:
+        headers['Vary'] = 'Accept-Encoding'
+        
+    # Browser copy is still current
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(body=None, status_code=304, headers=headers)
+    
+    response = Response.send_file(
+        filename,
+        max_age=max_age,
+        compressed=compressed,
+        file_extension='.gz' if compressed else ''
+    )
+    response.headers.update(headers)
+    response.headers['Content-Length'] = str(size)
+    
+    return response
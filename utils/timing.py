@@ -0,0 +1,77 @@
+import utime
+from utils import metrics
+
+# Request timing for the webserver. Each request is timed from the moment its
+# route is matched until the last byte of the response has been written, per
+# route and status code. Streamed responses also record the time to the first
+# byte, the difference between the two is how long the body took to produce
+# and send.
+
+
+class RequestTimer:
+    
+    def __init__(self, app):
+        self.durations = {}     # (route, status) -> Histogram, created on first use
+        self.first_bytes = {}
+        
+        app.before_request(self.start)
+        app.after_request(self.stream)
+        app.after_response(self.finish)
+    
+    def start(self, request):
+        request.g.start = utime.ticks_us()
+        request.g.first_byte = None
+    
+    def stream(self, request, response):
+        # Bodies that are not already in memory are produced as they are sent
+        if not isinstance(response.body, (bytes, bytearray, str)):
+            response.first_byte_handler = lambda: self.first_byte(request)
+        return response
+    
+    def first_byte(self, request):
+        request.g.first_byte = utime.ticks_us()
+    
+    def finish(self, request, response):
+        # Requests that matched no route were never started
+        start = getattr(request.g, 'start', None)
+        if start is None:
+            return
+        
+        key = (request.url_rule, response.status_code)
+        self.histogram(self.durations, key, 'pico_http_request_seconds',
+                       'Time from routing a request to the last byte of its response.'
+                       ).observe(utime.ticks_diff(utime.ticks_us(), start))
+        
+        if request.g.first_byte is not None:
+            self.histogram(self.first_bytes, key, 'pico_http_first_byte_seconds',
+                           'Time from routing a request to the first byte of a streamed response.'
+                           ).observe(utime.ticks_diff(request.g.first_byte, start))
+    
+    @staticmethod
+    def histogram(histograms, key, name, help):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = metrics.Histogram(
+                name, help, labels={'route': key[0], 'status': key[1]}
+            )
+        return histogram
+    
+    def summary(self):
+        # Per route and status: request count, then mean and 90th percentile
+        # times in milliseconds. Percentiles are bucket upper bounds
+        def times(histogram):
+            p90 = histogram.quantile(0.9)
+            return {
+                'mean_ms': histogram.mean() / 1000,
+                'p90_ms': p90 / 1000 if p90 is not None else None,
+            }
+        
+        summary = []
+        for (route, status), histogram in sorted(self.durations.items()):
+            entry = {'route': route, 'status': status, 'count': histogram.count()}
+            entry['last_byte'] = times(histogram)
+            if (route, status) in self.first_bytes:
+                entry['first_byte'] = times(self.first_bytes[(route, status)])
+            summary.append(entry)
+        
+        return summary